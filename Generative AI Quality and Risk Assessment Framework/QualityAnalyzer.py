@@ -1,34 +1,95 @@
+import codecs
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Models are only loaded from the local Hugging Face cache, run download_models.py once to fill it
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
 import torch
-from flask import Flask, request, jsonify
-from sentence_transformers import SentenceTransformer, util
+from flask import Flask, Response, request, jsonify, stream_with_context
+from sentence_transformers import SentenceTransformer
 from transformers import pipeline, AutoModelForSequenceClassification, AutoTokenizer
-import torch
-import nltk
+from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
-import logging
-import re
 
-nltk.download('punkt')
+from embeddings import EmbeddingCache, ReferenceSets
+from lru import LRUCache
+from model_manager import ModelManager
+from sensitive_scanner import SensitiveDataScanner
+from vector_index import VectorIndexes
 
 app = Flask(__name__)
 
 # Configure logging
 #logging.basicConfig(level=logging.DEBUG)
 
-# Load the pre-trained models
+# The pre-trained models
 # model_name = "Hate-speech-CNERG/dehatebert-mono-english"
 model_name = "unitary/toxic-bert"
-#model_hateanalysis = AutoModelForSequenceClassification.from_pretrained(model_name)
-#tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = SentenceTransformer('all-MiniLM-L6-v2')
-sentiment_analysis = pipeline('sentiment-analysis')
-
+sentence_model_name = 'all-MiniLM-L6-v2'
 toxic_word_model_name = "Hate-speech-CNERG/bert-base-uncased-hatexplain"
-model_hateanalysis = AutoModelForSequenceClassification.from_pretrained(model_name)
-toxic_word_model = AutoModelForSequenceClassification.from_pretrained(toxic_word_model_name)
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-toxic_word_tokenizer = AutoTokenizer.from_pretrained(toxic_word_model_name)
-#sentiment_analysis = pipeline('sentiment-analysis')
+emotion_model_name = "j-hartmann/emotion-english-distilroberta-base"
+
+# Models are loaded on first use. PRELOAD_MODELS=all, or a comma separated list of model names, loads them
+# at startup in parallel threads. Models not used for MODEL_IDLE_SECONDS are unloaded (0 keeps them loaded).
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '')
+MODEL_IDLE_SECONDS = float(os.environ.get('MODEL_IDLE_SECONDS', '0'))
+
+models = ModelManager(MODEL_IDLE_SECONDS)
+models.register('similarity', lambda: SentenceTransformer(sentence_model_name))
+models.register('sentiment', lambda: pipeline('sentiment-analysis'))
+models.register('emotion', lambda: pipeline("text-classification", model=emotion_model_name, return_all_scores=True))
+# (tokenizer, model) pairs
+models.register('toxicity', lambda: (AutoTokenizer.from_pretrained(model_name),
+                                     AutoModelForSequenceClassification.from_pretrained(model_name)))
+models.register('toxic_words', lambda: (AutoTokenizer.from_pretrained(toxic_word_model_name),
+                                        AutoModelForSequenceClassification.from_pretrained(toxic_word_model_name)))
+models.register('stopwords', lambda: set(stopwords.words('english')))
+
+# Words scored per forward pass of the toxic word model, and number of word scores kept across requests
+TOXIC_WORD_BATCH_SIZE = int(os.environ.get('TOXIC_WORD_BATCH_SIZE', '64'))
+TOXIC_WORD_CACHE_SIZE = int(os.environ.get('TOXIC_WORD_CACHE_SIZE', '10000'))
+
+# Confidence of the predicted label of the toxic word model, by word
+toxic_word_scores = LRUCache(TOXIC_WORD_CACHE_SIZE)
+
+# Texts per forward pass in the batch endpoints, and largest number of texts accepted by a batch request
+INFERENCE_BATCH_SIZE = int(os.environ.get('INFERENCE_BATCH_SIZE', '32'))
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '1000'))
+
+# Sentence embeddings kept in memory, and directory to also keep them on disk ('' keeps them in memory only)
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', '10000'))
+EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR', '')
+# Directory of the pre-embedded reference sets used by /comparetexts/reference/<name>
+REFERENCE_SET_DIR = os.environ.get('REFERENCE_SET_DIR', 'reference_sets')
+
+def encode_sentences(texts):
+    return models.get('similarity').encode(texts, batch_size=INFERENCE_BATCH_SIZE, convert_to_numpy=True,
+                                           normalize_embeddings=True)
+
+embedding_cache = EmbeddingCache(encode_sentences, sentence_model_name, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DIR or None)
+reference_sets = ReferenceSets(embedding_cache, REFERENCE_SET_DIR)
+
+# Approximate nearest neighbour indexes used by /comparetexts/index/<name>, for corpora too large to scan.
+# Queries score the vectors of the VECTOR_INDEX_N_PROBE nearest clusters, indexes smaller than
+# VECTOR_INDEX_MIN_TRAIN_SIZE are scanned exactly, and a VECTOR_INDEX_RECALL_SAMPLE_RATE fraction of the
+# queries is also answered exactly to measure recall.
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', 'vector_indexes')
+VECTOR_INDEX_N_PROBE = int(os.environ.get('VECTOR_INDEX_N_PROBE', '16'))
+VECTOR_INDEX_MIN_TRAIN_SIZE = int(os.environ.get('VECTOR_INDEX_MIN_TRAIN_SIZE', '10000'))
+VECTOR_INDEX_RECALL_SAMPLE_RATE = float(os.environ.get('VECTOR_INDEX_RECALL_SAMPLE_RATE', '0.01'))
+
+vector_indexes = VectorIndexes(embedding_cache, VECTOR_INDEX_DIR, n_probe=VECTOR_INDEX_N_PROBE,
+                               min_train_size=VECTOR_INDEX_MIN_TRAIN_SIZE,
+                               recall_sample_rate=VECTOR_INDEX_RECALL_SAMPLE_RATE)
+
+# Threads running the checks of an /evaluate request concurrently
+EVALUATION_WORKERS = int(os.environ.get('EVALUATION_WORKERS', '4'))
+evaluation_executor = ThreadPoolExecutor(max_workers=EVALUATION_WORKERS, thread_name_prefix='evaluate')
 
 # Regular expressions for sensitive information
 credit_card_pattern = re.compile(r'\b(?:\d[ -]*?){13,16}\b')
@@ -38,9 +99,6 @@ address_pattern = re.compile(r'\d{1,4} [\w\s]{1,20} (?:street|st|avenue|ave|road
 age_pattern = re.compile(r'\b(?:[1-9]?\d|100)\b')  # Matches age between 1 and 100
 gender_pattern = re.compile(r'\b(?:male|female|man|woman|boy|girl|he|she|him|her|his|hers)\b', re.IGNORECASE)
 
-# Load the emotion detection model
-emotion_pipeline = pipeline("text-classification", model="j-hartmann/emotion-english-distilroberta-base", return_all_scores=True)
-
 #map it to a list
 sensitive_data_patterns = {
     'credit_card_pattern': credit_card_pattern,
@@ -51,6 +109,32 @@ sensitive_data_patterns = {
     'gender_pattern': gender_pattern
 }
 
+# All sensitive data patterns with their matches and spans in one call
+sensitive_data_scanner = SensitiveDataScanner(sensitive_data_patterns)
+# Characters of text kept between the chunks of /detectsensitiveinfo/stream, the longest match it finds in full
+SENSITIVE_SCAN_OVERLAP = int(os.environ.get('SENSITIVE_SCAN_OVERLAP', '256'))
+
+def get_batch(data, key, strings=True):
+    """
+    Returns the list of a batch request stored under key, or an error response.
+    Unless strings is False, every item must be a non-empty string.
+    """
+    items = (data or {}).get(key)
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({'error': f'{key} must be a non-empty list'}), 400)
+    if len(items) > MAX_BATCH_SIZE:
+        return None, (jsonify({'error': f'At most {MAX_BATCH_SIZE} {key} are allowed per request'}), 413)
+    if strings and not all(isinstance(item, str) and item for item in items):
+        return None, (jsonify({'error': f'{key} must be non-empty strings'}), 400)
+    return items, None
+
+def highest_score_emotions(texts):
+    """
+    Returns the emotion with the highest score for each text.
+    """
+    results = models.get('emotion')(texts, batch_size=INFERENCE_BATCH_SIZE)
+    return [max(scores, key=lambda x: x['score']) for scores in results]
+
 @app.route('/emotion', methods=['POST'])
 def detect_emotion():
     data = request.json
@@ -59,14 +143,32 @@ def detect_emotion():
     if not text:
         return jsonify({'error': 'No text provided'}), 400
 
-    # Perform emotion detection
-    results = emotion_pipeline(text)
-    
-    # Extract the emotion with the highest score
-    highest_score_emotion = max(results[0], key=lambda x: x['score'])
+    # Perform emotion detection and extract the emotion with the highest score
+    highest_score_emotion = highest_score_emotions([text])[0]
     
     return jsonify({'text': text, 'emotion': highest_score_emotion['label'], 'score': highest_score_emotion['score']})
 
+@app.route('/emotion/batch', methods=['POST'])
+def detect_emotion_batch():
+    texts, error = get_batch(request.json, 'texts')
+    if error:
+        return error
+
+    results = [{'text': text, 'emotion': emotion['label'], 'score': emotion['score']}
+               for text, emotion in zip(texts, highest_score_emotions(texts))]
+
+    return jsonify({'results': results})
+
+def pairwise_similarity(texts1, texts2):
+    """
+    Returns the cosine similarity of each pair of texts. Texts not in the
+    embedding cache are encoded together, each distinct text once.
+    """
+    embeddings = embedding_cache.embed(texts1 + texts2)
+    embeddings1, embeddings2 = embeddings[:len(texts1)], embeddings[len(texts1):]
+    # the embeddings are normalized, their dot product is the cosine similarity
+    return (embeddings1 * embeddings2).sum(axis=1).tolist()
+
 @app.route('/comparetexts', methods=['POST'])
 def compare_texts():
     try:
@@ -78,18 +180,155 @@ def compare_texts():
         if not text1 or not text2:
             return jsonify({'error': 'Both text1 and text2 are required'}), 400
 
-        # Encode the texts
-        embedding1 = model.encode(text1, convert_to_tensor=True)
-        embedding2 = model.encode(text2, convert_to_tensor=True)
-
-        # Compute the cosine similarity
-        similarity_score = util.pytorch_cos_sim(embedding1, embedding2).item()
+        # Compute the cosine similarity of the (cached) embeddings
+        similarity_score = pairwise_similarity([text1], [text2])[0]
 
         return jsonify({'similarity_score': similarity_score})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/comparetexts/batch', methods=['POST'])
+def compare_texts_batch():
+    try:
+        # {"pairs": [{"text1": ..., "text2": ...}, ...]}
+        pairs, error = get_batch(request.json, 'pairs', strings=False)
+        if error:
+            return error
+        if not all(isinstance(pair, dict) and all(isinstance(pair.get(key), str) and pair[key] for key in ('text1', 'text2'))
+                   for pair in pairs):
+            return jsonify({'error': 'Both text1 and text2 are required in every pair'}), 400
+
+        similarity_scores = pairwise_similarity([pair['text1'] for pair in pairs], [pair['text2'] for pair in pairs])
+
+        return jsonify({'results': [{'similarity_score': score} for score in similarity_scores]})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/comparetexts/reference/<name>', methods=['PUT'])
+def put_reference_set(name):
+    """
+    Embeds and stores the reference set {"texts": [...]} under name, replacing any set with that name.
+    """
+    try:
+        texts, error = get_batch(request.json, 'texts')
+        if error:
+            return error
+
+        return jsonify({'name': name, 'size': reference_sets.put(name, texts)}), 201
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/comparetexts/reference', methods=['GET'])
+def list_reference_sets():
+    return jsonify({'names': reference_sets.names()})
+
+@app.route('/comparetexts/reference/<name>', methods=['POST'])
+def compare_with_reference_set(name):
+    """
+    Compares {"text": ..., "top_k": 5} with every text of the reference set
+    in one matrix product and returns the top_k most similar ones.
+    """
+    try:
+        data = request.json
+        text = data.get('text')
+        top_k = data.get('top_k', 5)
+
+        if not text:
+            return jsonify({'error': 'Text is required'}), 400
+        if not isinstance(top_k, int) or top_k < 1:
+            return jsonify({'error': 'top_k must be a positive integer'}), 400
+
+        results = reference_sets.top_k(name, text, top_k)
+
+        return jsonify({'results': [{'text': reference_text, 'similarity_score': score}
+                                    for reference_text, score in results]})
+
+    except KeyError:
+        return jsonify({'error': f'Unknown reference set {name}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/comparetexts/index/<name>/add', methods=['POST'])
+def add_to_index(name):
+    """
+    Adds {"texts": [...]} to the vector index, creating it if needed, and returns their ids.
+    """
+    try:
+        texts, error = get_batch(request.json, 'texts')
+        if error:
+            return error
+
+        return jsonify({'ids': vector_indexes.add(name, texts)})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/comparetexts/index/<name>/delete', methods=['POST'])
+def delete_from_index(name):
+    """
+    Deletes {"ids": [...]} from the vector index.
+    """
+    try:
+        ids, error = get_batch(request.json, 'ids', strings=False)
+        if error:
+            return error
+        if not all(isinstance(vector_id, int) for vector_id in ids):
+            return jsonify({'error': 'ids must be integers'}), 400
+
+        return jsonify({'deleted': vector_indexes.get(name).delete(ids)})
+
+    except KeyError:
+        return jsonify({'error': f'Unknown index {name}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/comparetexts/index/<name>/search', methods=['POST'])
+def search_index(name):
+    """
+    Returns the texts of the vector index most similar to {"text": ...}, at
+    most top_k (default 5) of them and, when threshold is given, only those
+    with a similarity score of at least threshold. top_k can be null when a
+    threshold is given.
+    """
+    try:
+        data = request.json
+        text = data.get('text')
+        top_k = data.get('top_k', 5)
+        threshold = data.get('threshold')
+
+        if not text:
+            return jsonify({'error': 'Text is required'}), 400
+        if top_k is None and threshold is None:
+            return jsonify({'error': 'top_k or threshold is required'}), 400
+        if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+            return jsonify({'error': 'top_k must be a positive integer'}), 400
+
+        results = vector_indexes.search(name, text, top_k, threshold)
+
+        return jsonify({'results': [{'id': vector_id, 'text': indexed_text, 'similarity_score': score}
+                                    for vector_id, indexed_text, score in results]})
+
+    except KeyError:
+        return jsonify({'error': f'Unknown index {name}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/comparetexts/index/<name>', methods=['GET'])
+def index_stats(name):
+    """
+    Returns the size, clustering, query latency and measured recall of the vector index.
+    """
+    try:
+        return jsonify(vector_indexes.get(name).stats())
+
+    except KeyError:
+        return jsonify({'error': f'Unknown index {name}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/sentiment', methods=['POST'])
 def analyze_sentiment():
     try:
@@ -101,7 +340,7 @@ def analyze_sentiment():
             return jsonify({'error': 'Text is required'}), 400
 
         # Perform sentiment analysis
-        result = sentiment_analysis(text)[0]
+        result = models.get('sentiment')(text)[0]
 
         return jsonify({
             'label': result['label'],
@@ -111,6 +350,35 @@ def analyze_sentiment():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/sentiment/batch', methods=['POST'])
+def analyze_sentiment_batch():
+    try:
+        texts, error = get_batch(request.json, 'texts')
+        if error:
+            return error
+
+        results = models.get('sentiment')(texts, batch_size=INFERENCE_BATCH_SIZE)
+
+        return jsonify({'results': [{'label': result['label'], 'score': result['score']} for result in results]})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def toxicity_scores(texts):
+    """
+    Returns the probability of the predicted label of the toxicity model for
+    each text, scored in padded batches of INFERENCE_BATCH_SIZE.
+    """
+    tokenizer, model_hateanalysis = models.get('toxicity')
+    scores = []
+    for start in range(0, len(texts), INFERENCE_BATCH_SIZE):
+        inputs = tokenizer(texts[start:start + INFERENCE_BATCH_SIZE], return_tensors='pt', truncation=True, padding=True)
+        with torch.no_grad():
+            outputs = model_hateanalysis(**inputs)
+        probs = torch.softmax(outputs.logits, dim=-1)
+        scores.extend(probs.max(dim=-1).values.tolist())
+    return scores
+
 @app.route('/toxicassessment', methods=['POST'])
 def detect_inappropriate_terms():
     """
@@ -130,28 +398,54 @@ def detect_inappropriate_terms():
         return jsonify({'error': 'Threshold is required'}), 400
 
     
-    # Tokenize and encode the text
-    inputs = tokenizer(text, return_tensors='pt', truncation=True, padding=True)
+    toxic_content = assess_toxicity(text, threshold)
 
-    # Perform forward pass through the model
-    with torch.no_grad():
-        outputs = model_hateanalysis(**inputs)
+    if toxic_content:
+        return jsonify(toxic_content)
+    else:
+        return [], []
 
-    # Get the predicted probabilities
-    probs = torch.softmax(outputs.logits, dim=-1)
-    predicted_label = torch.argmax(probs)
+def assess_toxicity(text, threshold):
+    """
+    Returns the toxicity result and toxic words of the text, [] when it is not toxic.
+    """
+    # Probability of the predicted label
+    score = toxicity_scores([text])[0]
 
     logging.debug(f"Text: {text}")
-    logging.debug(f"Probabilities: {probs}")
-    logging.debug(f"Predicted label: {predicted_label}")
+    logging.debug(f"Score: {score}")
 
-    if probs[0][predicted_label] > threshold:
-        return jsonify({
+    if score > threshold:
+        return {
             'result': "Toxic Content Detected",
             'toxicwords': detect_toxic_words(text, threshold)
-        })
-    else:
-        return [], []
+        }
+    return []
+
+@app.route('/toxicassessment/batch', methods=['POST'])
+def detect_inappropriate_terms_batch():
+    """
+    Batch form of /toxicassessment, {"texts": [...], "threshold": ...}.
+    Each result is the response /toxicassessment gives for that text.
+    """
+    data = request.json
+    texts, error = get_batch(data, 'texts')
+    if error:
+        return error
+
+    threshold = data.get('threshold')
+    if threshold is None:
+        return jsonify({'error': 'Threshold is required'}), 400
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+        return jsonify({'error': 'Threshold must be a number'}), 400
+
+    toxic_texts = [text for text, score in zip(texts, toxicity_scores(texts)) if score > threshold]
+    toxic_words = dict(zip(toxic_texts, detect_toxic_words_batch(toxic_texts, threshold)))
+
+    results = [{'result': "Toxic Content Detected", 'toxicwords': toxic_words[text]} if text in toxic_words else []
+               for text in texts]
+
+    return jsonify({'results': results})
     
 def list_sensitive_info(text,sensitive_data_name):
     """
@@ -180,27 +474,227 @@ def detect_sensitive_info():
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def get_sensitive_data_names(names, key='sensitive_data_names', default_all=True):
+    """
+    Returns the requested pattern names, all patterns when none are given
+    unless default_all is False, or an error response.
+    """
+    if names is None:
+        names = []
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        return None, (jsonify({'error': f'{key} must be a list of sensitive data names'}), 400)
+    if not names and default_all:
+        names = list(sensitive_data_patterns)
+    unknown = [name for name in names if name not in sensitive_data_patterns]
+    if unknown:
+        return None, (jsonify({'error': f'Unknown sensitive data names {unknown}'}), 400)
+    return names, None
+
+@app.route('/detectsensitiveinfo/all', methods=['POST'])
+def detect_all_sensitive_info():
+    """
+    Scans {"text": ..., "sensitive_data_names": [...]} for all the given
+    patterns, all of them by default, and returns the values found per
+    pattern and every match with its span.
+    """
+    try:
+        data = request.json
+        text = data.get('text')
+
+        if not text:
+            return jsonify({'error': 'Text is required'}), 400
+
+        names, error = get_sensitive_data_names(data.get('sensitive_data_names'))
+        if error:
+            return error
+
+        matches = sensitive_data_scanner.scan(text, names)
+        sensitive_info = {name: [] for name in names}
+        for match in matches:
+            sensitive_info[match['name']].append(match['value'])
+
+        return jsonify({'sensitive_info': sensitive_info, 'matches': matches})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/detectsensitiveinfo/stream', methods=['POST'])
+def detect_sensitive_info_stream():
+    """
+    Scans a large UTF-8 document sent as the raw request body as it arrives,
+    for the patterns in the comma separated sensitive_data_names query
+    parameter (all by default). Returns one JSON match per line as the
+    matches are found.
+    """
+    names, error = get_sensitive_data_names([name for name in request.args.get('sensitive_data_names', '').split(',') if name])
+    if error:
+        return error
+
+    def read_chunks():
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            chunk = request.stream.read(64 * 1024)
+            if not chunk:
+                break
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    def generate():
+        for match in sensitive_data_scanner.scan_stream(read_chunks(), names, SENSITIVE_SCAN_OVERLAP):
+            yield json.dumps(match) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
     
-def detect_toxic_words(text, threshold):
+def find_similar_output(text, similarity_threshold, validated_outputs=(), reference_set=None):
     """
-    Detects and returns a list of toxic words in the given text using a more specialized model.
+    Compares the text with every verified output, given as a list or as the
+    name of a reference set, and returns the last one with a similarity
+    score above similarity_threshold, as the similarity_finder_result of invokeAPI.py.
+    """
+    if reference_set:
+        outputs, scores = reference_sets.similarities(reference_set, text)
+    else:
+        outputs = list(validated_outputs)
+        scores = pairwise_similarity([text] * len(outputs), outputs) if outputs else []
+
+    similarity_finder = {
+        "output_text": text,
+        "comparable_verified_output": "none",
+        "similarity_score": 0.0
+    }
+    for output, score in zip(outputs, scores):
+        if score > similarity_threshold:
+            similarity_finder = {
+                "comparable_verified_output": output,
+                "similarity_score": float(score)
+            }
+    return similarity_finder
+
+@app.route('/evaluate', methods=['POST'])
+def evaluate():
+    """
+    Runs all quality checks on an LLM output in one request and returns the
+    data_evaluation of invokeAPI.py. Takes {"text": ..., "validated_output": [...]
+    or "reference_set": name, "similarity_threshold": ..., "tolerance_threshold": ...,
+    "sensitive_info": [pattern names]}. The similarity, sentiment, emotion and
+    toxicity checks run concurrently.
+    """
+    try:
+        data = request.json
+        text = data.get('text')
+        similarity_threshold = data.get('similarity_threshold')
+        tolerance_threshold = data.get('tolerance_threshold')
+
+        if not text:
+            return jsonify({'error': 'Text is required'}), 400
+        if similarity_threshold is None or tolerance_threshold is None:
+            return jsonify({'error': 'similarity_threshold and tolerance_threshold are required'}), 400
+
+        sensitive_data_names, error = get_sensitive_data_names(data.get('sensitive_info'), 'sensitive_info',
+                                                               default_all=False)
+        if error:
+            return error
+
+        reference_set = data.get('reference_set')
+        if reference_set:
+            try:
+                reference_sets.get(reference_set)
+            except KeyError:
+                return jsonify({'error': f'Unknown reference set {reference_set}'}), 404
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        similarity_finder = evaluation_executor.submit(find_similar_output, text, similarity_threshold,
+                                                       data.get('validated_output', []), reference_set)
+        sentiment = evaluation_executor.submit(lambda: models.get('sentiment')(text)[0]['label'])
+        emotion = evaluation_executor.submit(lambda: highest_score_emotions([text])[0]['label'])
+        toxic_content = evaluation_executor.submit(assess_toxicity, text, tolerance_threshold)
+
+        found = sensitive_data_scanner.findall(text, sensitive_data_names)
+        sensitive_info = [{
+            "sensitive_info_name": sensitive_data_name,
+            "sensitive_info_value": found[sensitive_data_name]
+        } for sensitive_data_name in sensitive_data_names]
+
+        data_evaluation = {
+            "llm_output": text,
+            "similarity_finder_result": similarity_finder.result(),
+            "sentiment": sentiment.result(),
+            "emotion": emotion.result(),
+            "toxic_content": toxic_content.result(),
+            "sensitive_data": sensitive_info
+        }
+
+        # serialized here to keep the key order of invokeAPI.py, jsonify sorts keys
+        return app.response_class(json.dumps(data_evaluation, ensure_ascii=False), mimetype='application/json')
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def is_candidate_word(word, english_stopwords):
+    """
+    Stopwords and punctuation are not scored by the toxic word model.
+    """
+    return word.lower() not in english_stopwords and any(char.isalnum() for char in word)
+
+def score_toxic_words(words):
+    """
+    Returns the confidence of the predicted label of the toxic word model for
+    each distinct word. Words not in the cache are tokenized and scored in
+    padded batches of TOXIC_WORD_BATCH_SIZE.
     """
-    toxic_words = []
-    words = word_tokenize(text)
-    for word in words:
-        inputs = toxic_word_tokenizer(word, return_tensors='pt', truncation=True, padding=True)
+    scores = {}
+    unscored = []
+    for word in dict.fromkeys(words):
+        score = toxic_word_scores.get(word)
+        if score is None:
+            unscored.append(word)
+        else:
+            scores[word] = score
+
+    if unscored:
+        toxic_word_tokenizer, toxic_word_model = models.get('toxic_words')
+    for start in range(0, len(unscored), TOXIC_WORD_BATCH_SIZE):
+        batch = unscored[start:start + TOXIC_WORD_BATCH_SIZE]
+        inputs = toxic_word_tokenizer(batch, return_tensors='pt', truncation=True, padding=True)
         with torch.no_grad():
             outputs = toxic_word_model(**inputs)
         probs = torch.softmax(outputs.logits, dim=-1)
-        predicted_label = torch.argmax(probs)
+        for word, score in zip(batch, probs.max(dim=-1).values.tolist()):
+            toxic_word_scores.put(word, score)
+            scores[word] = score
+
+    return scores
+
+def detect_toxic_words_batch(texts, threshold):
+    """
+    Returns the toxic words of each text, the words of all texts are scored together.
+    """
+    english_stopwords = models.get('stopwords')
+    words_per_text = [[word for word in word_tokenize(text) if is_candidate_word(word, english_stopwords)]
+                      for text in texts]
+    scores = score_toxic_words([word for words in words_per_text for word in words])
+
+    logging.debug(f"Word scores: {scores}")
+
+    return [[word for word in words if scores[word] > threshold] for words in words_per_text]
+
+def detect_toxic_words(text, threshold):
+    """
+    Detects and returns a list of toxic words in the given text using a more specialized model.
+    """
+    return detect_toxic_words_batch([text], threshold)[0]
 
-        logging.debug(f"Word: {word}")
-        logging.debug(f"Probabilities: {probs}")
-        logging.debug(f"Predicted label: {predicted_label}")
+@app.route('/models', methods=['GET'])
+def model_stats():
+    """
+    Returns the load state, load time and RSS change of every model.
+    """
+    return jsonify(dict(models.stats(), embedding_cache=embedding_cache.stats()))
 
-        if probs[0][predicted_label] > threshold:
-            toxic_words.append(word)
-    return toxic_words
+if PRELOAD_MODELS:
+    models.load_all(None if PRELOAD_MODELS == 'all' else PRELOAD_MODELS.split(','))
 
 if __name__ == '__main__':
     app.run(debug=True)
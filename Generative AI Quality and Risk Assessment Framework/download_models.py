@@ -0,0 +1,17 @@
+import json
+import os
+
+# QualityAnalyzer.py only reads the local cache, allow downloads while filling it
+os.environ['HF_HUB_OFFLINE'] = '0'
+os.environ['TRANSFORMERS_OFFLINE'] = '0'
+
+import nltk
+
+from QualityAnalyzer import models
+
+# Downloads the NLTK data and the pre-trained models used by QualityAnalyzer.py into the local caches
+if __name__ == '__main__':
+    nltk.download('punkt')
+    nltk.download('stopwords')
+    models.load_all()
+    print(json.dumps(models.stats(), indent=4))
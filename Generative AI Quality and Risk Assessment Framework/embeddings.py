@@ -0,0 +1,156 @@
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+
+from lru import LRUCache
+
+
+class EmbeddingCache:
+    """
+    Normalized sentence embeddings keyed by a hash of the model name and the
+    text, kept in an LRU cache and, when cache_dir is set, in one .npy file per
+    text on disk so they survive restarts. Texts missing from both are encoded
+    together in one call to encode.
+    """
+
+    def __init__(self, encode, model_name, max_entries=10000, cache_dir=None):
+        # encode(texts) returns a (len(texts), dim) array of normalized embeddings
+        self.encode = encode
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.memory = LRUCache(max_entries)
+        self.encoded = 0
+        self.disk_hits = 0
+
+    def key(self, text):
+        return hashlib.sha256(f'{self.model_name}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            return np.load(self._path(key))
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, embedding):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written under a temporary name so readers never see a partial file
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'wb') as embedding_file:
+            np.save(embedding_file, embedding)
+        os.replace(temporary_path, path)
+
+    def embed(self, texts):
+        """
+        Returns the normalized embeddings of the texts as a (len(texts), dim) float32 array.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key in found or key in missing:
+                continue
+            embedding = self.memory.get(key)
+            if embedding is None:
+                embedding = self._load(key)
+                if embedding is not None:
+                    self.disk_hits += 1
+                    self.memory.put(key, embedding)
+            if embedding is None:
+                missing[key] = text
+            else:
+                found[key] = embedding
+
+        if missing:
+            encoded = np.asarray(self.encode(list(missing.values())), dtype=np.float32)
+            self.encoded += len(missing)
+            for key, embedding in zip(missing, encoded):
+                self.memory.put(key, embedding)
+                self._store(key, embedding)
+                found[key] = embedding
+
+        return np.stack([found[key] for key in keys])
+
+    def stats(self):
+        return dict(self.memory.stats(), encoded=self.encoded, disk_hits=self.disk_hits,
+                    cache_dir=self.cache_dir)
+
+
+class ReferenceSets:
+    """
+    Named sets of reference texts stored with their normalized embeddings as
+    one matrix, so a candidate is compared with a whole set in a single matrix
+    product. Sets are saved to directory as <name>.npz and loaded on first use.
+    """
+
+    NAME_PATTERN = re.compile(r'^[\w-]{1,100}$')
+
+    def __init__(self, embedding_cache, directory):
+        self.embedding_cache = embedding_cache
+        self.directory = directory
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        if not self.NAME_PATTERN.match(name):
+            raise ValueError(f'Invalid reference set name {name!r}, use letters, digits, _ and -')
+        return os.path.join(self.directory, name + '.npz')
+
+    def put(self, name, texts):
+        """
+        Embeds and stores the reference set, replacing a set with the same name.
+        """
+        path = self._path(name)
+        texts = list(dict.fromkeys(texts))
+        matrix = self.embedding_cache.embed(texts)
+        os.makedirs(self.directory, exist_ok=True)
+        np.savez(path, texts=np.array(texts, dtype=str), embeddings=matrix)
+        with self._lock:
+            self._sets[name] = (texts, matrix)
+        return len(texts)
+
+    def get(self, name):
+        """
+        Returns the texts and embedding matrix of the set, KeyError when it does not exist.
+        """
+        with self._lock:
+            if name not in self._sets:
+                path = self._path(name)
+                if not os.path.exists(path):
+                    raise KeyError(name)
+                with np.load(path) as stored:
+                    self._sets[name] = (stored['texts'].tolist(), stored['embeddings'])
+            return self._sets[name]
+
+    def names(self):
+        stored = [file_name[:-4] for file_name in os.listdir(self.directory)
+                  if file_name.endswith('.npz')] if os.path.isdir(self.directory) else []
+        with self._lock:
+            return sorted(set(stored) | set(self._sets))
+
+    def similarities(self, name, text):
+        """
+        Returns the reference texts and the similarity of text with each of them.
+        """
+        texts, matrix = self.get(name)
+        return texts, matrix @ self.embedding_cache.embed([text])[0]
+
+    def top_k(self, name, text, k=5):
+        """
+        Returns the k reference texts most similar to text as (text, similarity) pairs.
+        """
+        texts, similarities = self.similarities(name, text)
+        k = min(k, len(texts))
+        best = np.argpartition(-similarities, k - 1)[:k] if k else []
+        best = sorted(best, key=lambda i: -similarities[i])
+        return [(texts[i], float(similarities[i])) for i in best]
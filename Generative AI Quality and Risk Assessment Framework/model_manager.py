@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def current_rss_bytes():
+    """
+    Resident set size of the current process in bytes, 0 when it cannot be read.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ModelManager:
+    """
+    Loads registered models on first use and shares them between requests.
+
+    Every model has a loader function and is loaded at most once at a time.
+    Load time and the change in process RSS are recorded per model (RSS is
+    only indicative when several models load in parallel). When idle_seconds
+    is set, models not used for that long are unloaded and loaded again on
+    their next use.
+    """
+
+    def __init__(self, idle_seconds=0):
+        self.idle_seconds = idle_seconds
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        if idle_seconds:
+            threading.Thread(target=self._unload_idle_forever, name='model-reaper', daemon=True).start()
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks[name] = threading.Lock()
+            self._stats[name] = {'loaded': False, 'loads': 0, 'load_seconds': None,
+                                 'rss_delta_bytes': None, 'last_used': None}
+
+    def get(self, name):
+        """
+        Returns the model, loading it if needed.
+        """
+        stats = self._stats[name]
+        stats['last_used'] = time.time()
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                rss_before = current_rss_bytes()
+                started = time.perf_counter()
+                model = self._loaders[name]()
+                stats['load_seconds'] = time.perf_counter() - started
+                stats['rss_delta_bytes'] = current_rss_bytes() - rss_before
+                stats['loads'] += 1
+                stats['loaded'] = True
+                self._models[name] = model
+                logging.info(f"Loaded {name} in {stats['load_seconds']:.1f}s")
+        return model
+
+    def load_all(self, names=None, max_workers=None):
+        """
+        Loads the given models, all registered models by default, in parallel threads.
+        """
+        names = list(names or self._loaders)
+        with ThreadPoolExecutor(max_workers=max_workers or len(names) or 1, thread_name_prefix='model-loader') as executor:
+            list(executor.map(self.get, names))
+
+    def unload(self, name):
+        with self._locks[name]:
+            if self._models.pop(name, None) is not None:
+                self._stats[name]['loaded'] = False
+                logging.info(f"Unloaded {name}")
+
+    def unload_idle(self):
+        """
+        Unloads the models not used for idle_seconds, returns their names.
+        """
+        now = time.time()
+        idle = [name for name, stats in self._stats.items()
+                if name in self._models and now - stats['last_used'] > self.idle_seconds]
+        for name in idle:
+            self.unload(name)
+        return idle
+
+    def _unload_idle_forever(self):
+        while True:
+            time.sleep(max(self.idle_seconds / 2, 1))
+            self.unload_idle()
+
+    def stats(self):
+        return {
+            'rss_bytes': current_rss_bytes(),
+            'models': {name: dict(stats) for name, stats in self._stats.items()}
+        }
@@ -0,0 +1,66 @@
+import heapq
+
+
+class SensitiveDataScanner:
+    """
+    Finds the matches of all sensitive data patterns in a text with one call,
+    as {"name", "value", "start", "end"} ordered by start.
+
+    Each pattern finds exactly what its own findall() finds, so patterns may
+    match overlapping text, e.g. an age that is also an account balance.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = dict(patterns)
+
+    def _matches(self, name, text, pos, endpos, offset, resume):
+        """
+        Yields the matches of the pattern starting in text[pos:endpos], resume
+        holds the end of the last match of each pattern in absolute offsets.
+        """
+        for match in self.patterns[name].finditer(text, max(pos, resume[name] - offset)):
+            if match.start() >= endpos:
+                break
+            resume[name] = offset + match.end()
+            yield {'name': name, 'value': match.group(), 'start': offset + match.start(), 'end': offset + match.end()}
+
+    def _scan(self, text, pos, endpos, offset, resume, names):
+        return heapq.merge(*(self._matches(name, text, pos, endpos, offset, resume) for name in names),
+                           key=lambda match: match['start'])
+
+    def scan(self, text, names=None):
+        """
+        Returns the matches of the given patterns, all patterns by default.
+        """
+        names = list(self.patterns) if names is None else names
+        return list(self._scan(text, 0, len(text), 0, dict.fromkeys(names, 0), names))
+
+    def scan_stream(self, chunks, names=None, overlap=256):
+        """
+        Yields the matches of a text given as an iterable of chunks, keeping
+        about two overlaps of text in memory. Matches are final once overlap
+        characters of text follow their start, so matches longer than overlap
+        may be cut short.
+        """
+        names = list(self.patterns) if names is None else names
+        buffer = ''
+        offset = 0
+        pos = 0
+        resume = dict.fromkeys(names, 0)
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) < 2 * overlap:
+                continue
+            safe = len(buffer) - overlap
+            yield from self._scan(buffer, pos, safe, offset, resume, names)
+            # keep one character before the next position to scan for \b
+            offset += safe - 1
+            buffer = buffer[safe - 1:]
+            pos = 1
+        yield from self._scan(buffer, pos, len(buffer), offset, resume, names)
+
+    def findall(self, text, names=None):
+        """
+        Returns the matched values by pattern name, pattern.findall(text) for each pattern.
+        """
+        return {name: self.patterns[name].findall(text) for name in (self.patterns if names is None else names)}
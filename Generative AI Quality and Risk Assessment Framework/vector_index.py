@@ -0,0 +1,365 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+def kmeans(vectors, k, iterations=10, sample_size=256, seed=0):
+    """
+    Spherical k-means on normalized vectors, trained on at most sample_size
+    vectors per centroid. Returns the (k, dim) normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > k * sample_size:
+        vectors = vectors[rng.choice(len(vectors), k * sample_size, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        # empty clusters keep their previous centroid
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids
+
+
+def nearest_centroids(vectors, centroids, chunk_size=16384):
+    return np.concatenate([np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+                           for start in range(0, len(vectors), chunk_size)] or [np.empty(0, dtype=np.int64)])
+
+
+class VectorIndex:
+    """
+    Inverted file index of normalized embeddings for cosine similarity search,
+    in the style of FAISS IVF-Flat, CPU only.
+
+    Vectors are grouped around k-means centroids and a query only scores the
+    vectors of its n_probe nearest groups. Until the index holds
+    min_train_size vectors every query is an exact scan. The centroids are
+    retrained when the index has grown four times since the last training.
+
+    The index is kept in directory: every add writes a new segment, deletes
+    are recorded in a list of deleted ids, and training rewrites the index as
+    one segment. Above max_segments segments, the newer, smaller ones are
+    merged so their sizes shrink about geometrically. The next id is kept in
+    meta.json, so ids are never reused. A sample of the queries is also answered exactly to measure
+    recall.
+    """
+
+    def __init__(self, directory, n_probe=16, min_train_size=10000, recall_sample_rate=0.01, max_segments=16):
+        self.directory = directory
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.recall_sample_rate = recall_sample_rate
+        self.max_segments = max_segments
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = None
+        self.texts = []
+        self.lists = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.rows = {}
+        self.centroids = None
+        self.trained_size = 0
+        self.next_id = 0
+        self.segments = 0
+        # number of rows of each segment on disk, in the order of the rows
+        self.segment_sizes = []
+        self._list_rows = None
+        self._lock = threading.RLock()
+        self._rng = np.random.default_rng()
+        self._latencies = deque(maxlen=1000)
+        self._recalls = deque(maxlen=1000)
+        self.queries = 0
+        self.scanned = 0
+        if os.path.isdir(directory):
+            self._load()
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def _segment_paths(self):
+        names = [file_name for file_name in os.listdir(self.directory) if re.match(r'^segment-\d+\.npz$', file_name)]
+        return [os.path.join(self.directory, file_name)
+                for file_name in sorted(names, key=lambda file_name: int(file_name[8:-4]))]
+
+    def _load(self):
+        centroids_path = os.path.join(self.directory, 'centroids.npy')
+        if os.path.exists(centroids_path):
+            self.centroids = np.load(centroids_path)
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                self.next_id = json.load(meta_file)['next_id']
+        ids, vectors, lists, texts = [], [], [], []
+        for path in self._segment_paths():
+            with np.load(path) as segment:
+                ids.append(segment['ids'])
+                vectors.append(segment['vectors'])
+                lists.append(segment['lists'])
+            with open(path[:-4] + '.json') as texts_file:
+                texts.extend(json.load(texts_file))
+            self.segment_sizes.append(len(ids[-1]))
+            self.segments = max(self.segments, int(os.path.basename(path)[8:-4]) + 1)
+        if not sum(self.segment_sizes):
+            return
+        self.ids = np.concatenate(ids)
+        self.vectors = np.concatenate(vectors)
+        self.lists = np.concatenate(lists)
+        self.texts = texts
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        # indexes written before meta.json existed
+        self.next_id = max(self.next_id, int(self.ids.max()) + 1)
+        # a later segment holding an id replaces the earlier copy (interrupted compaction)
+        for row, vector_id in enumerate(self.ids.tolist()):
+            if vector_id in self.rows:
+                self.alive[self.rows[vector_id]] = False
+            self.rows[vector_id] = row
+        deleted_path = os.path.join(self.directory, 'deleted.npy')
+        if os.path.exists(deleted_path):
+            for vector_id in np.load(deleted_path).tolist():
+                row = self.rows.pop(vector_id, None)
+                if row is not None:
+                    self.alive[row] = False
+        if self.centroids is not None:
+            unassigned = self.lists < 0
+            if unassigned.any():
+                self.lists[unassigned] = nearest_centroids(self.vectors[unassigned], self.centroids)
+            self.trained_size = len(self)
+
+    def _write_meta(self, next_id):
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as meta_file:
+            json.dump({'next_id': next_id}, meta_file)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _write_segment(self, ids, vectors, lists, texts):
+        # the next id is saved before the segment, so it always covers the saved ids
+        self._write_meta(max(self.next_id, int(ids.max()) + 1))
+        path = os.path.join(self.directory, f'segment-{self.segments}')
+        # texts first, a segment is only loaded once its .npz exists
+        with open(path + '.json', 'w') as texts_file:
+            json.dump(texts, texts_file)
+        np.savez(path + '.tmp.npz', ids=ids, vectors=vectors, lists=lists)
+        os.replace(path + '.tmp.npz', path + '.npz')
+        self.segments += 1
+
+    def _write_deleted(self):
+        deleted = np.array(sorted(set(self.ids[~self.alive].tolist()) - set(self.rows)), dtype=np.int64)
+        path = os.path.join(self.directory, 'deleted.npy')
+        np.save(path + '.tmp.npy', deleted)
+        os.replace(path + '.tmp.npy', path)
+
+    def add(self, texts, vectors):
+        """
+        Adds the texts with their normalized embeddings, returns their ids.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            ids = np.arange(self.next_id, self.next_id + len(texts), dtype=np.int64)
+            lists = nearest_centroids(vectors, self.centroids) if self.centroids is not None \
+                else np.full(len(texts), -1, dtype=np.int64)
+            self._write_segment(ids, vectors, lists, list(texts))
+            self.segment_sizes.append(len(ids))
+            start = len(self.ids)
+            self.ids = np.concatenate([self.ids, ids])
+            self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+            self.lists = np.concatenate([self.lists, lists])
+            self.texts.extend(texts)
+            self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+            self.rows.update((vector_id, start + i) for i, vector_id in enumerate(ids.tolist()))
+            self.next_id += len(ids)
+            self._list_rows = None
+            size = len(self)
+            if (self.centroids is None and size >= self.min_train_size) or \
+                    (self.centroids is not None and size > 4 * self.trained_size):
+                self.train()
+            elif len(self.segment_sizes) > self.max_segments:
+                self._merge(self._first_to_merge())
+            return ids.tolist()
+
+    def delete(self, ids):
+        """
+        Deletes the vectors with the given ids, returns how many existed.
+        """
+        with self._lock:
+            rows = [self.rows.pop(vector_id) for vector_id in ids if vector_id in self.rows]
+            if not rows:
+                return 0
+            self.alive[rows] = False
+            if (~self.alive).sum() > 0.25 * len(self.alive):
+                self.compact()
+            else:
+                self._write_deleted()
+            return len(rows)
+
+    def train(self):
+        """
+        Clusters the vectors around about sqrt(size) centroids and rewrites the index.
+        """
+        with self._lock:
+            vectors = self.vectors[self.alive]
+            self.centroids = kmeans(vectors, max(1, int(np.sqrt(len(vectors)))))
+            self.lists = np.full(len(self.ids), -1, dtype=np.int64)
+            self.lists[self.alive] = nearest_centroids(vectors, self.centroids)
+            self.trained_size = len(vectors)
+            os.makedirs(self.directory, exist_ok=True)
+            centroids_path = os.path.join(self.directory, 'centroids.npy')
+            np.save(centroids_path + '.tmp.npy', self.centroids)
+            os.replace(centroids_path + '.tmp.npy', centroids_path)
+            self.compact()
+
+    def _first_to_merge(self):
+        """
+        The first segment not larger than all later segments together, merging
+        from there on keeps every segment larger than the ones after it.
+        """
+        for i, size in enumerate(self.segment_sizes[:-1]):
+            if size <= sum(self.segment_sizes[i + 1:]):
+                return i
+        return len(self.segment_sizes) - 2
+
+    def _merge(self, first):
+        """
+        Rewrites the segments from first on as one segment without the deleted vectors.
+        """
+        with self._lock:
+            old_segments = self._segment_paths()[first:] if os.path.isdir(self.directory) else []
+            if os.path.isdir(self.directory):
+                # until the old segments are removed they still hold the deleted vectors
+                self._write_deleted()
+            start = sum(self.segment_sizes[:first])
+            keep = self.alive.copy()
+            keep[:start] = True
+            self.ids, self.vectors, self.lists = self.ids[keep], self.vectors[keep], self.lists[keep]
+            self.texts = [text for text, kept in zip(self.texts, keep.tolist()) if kept]
+            self.alive = self.alive[keep]
+            self.rows = {vector_id: row for row, vector_id in enumerate(self.ids.tolist()) if self.alive[row]}
+            self._list_rows = None
+            self.segment_sizes = self.segment_sizes[:first]
+            if len(self.ids) > start:
+                self._write_segment(self.ids[start:], self.vectors[start:], self.lists[start:], self.texts[start:])
+                self.segment_sizes.append(len(self.ids) - start)
+            else:
+                # nothing left to write, the next id must still outlive the removed segments
+                self._write_meta(self.next_id)
+            for path in old_segments:
+                os.remove(path)
+                os.remove(path[:-4] + '.json')
+
+    def compact(self):
+        """
+        Drops deleted vectors and rewrites the index as a single segment.
+        """
+        with self._lock:
+            self._merge(0)
+            deleted_path = os.path.join(self.directory, 'deleted.npy')
+            if os.path.exists(deleted_path):
+                os.remove(deleted_path)
+
+    def _rows_of_lists(self, lists):
+        if self._list_rows is None:
+            order = np.argsort(self.lists, kind='stable')
+            bounds = np.searchsorted(self.lists[order], np.arange(len(self.centroids) + 1))
+            self._list_rows = (order, bounds)
+        order, bounds = self._list_rows
+        return np.concatenate([order[bounds[i]:bounds[i + 1]] for i in lists])
+
+    def _top(self, rows, query, k, threshold):
+        scores = self.vectors[rows] @ query
+        if threshold is not None:
+            above = scores >= threshold
+            rows, scores = rows[above], scores[above]
+        if k is not None and len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return rows[order], scores[order]
+
+    def search(self, query, k=5, threshold=None, n_probe=None):
+        """
+        Returns up to k (id, text, similarity) matches with a similarity of at
+        least threshold, most similar first. Either limit can be None.
+        """
+        started = time.perf_counter()
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            if self.vectors is None:
+                return []
+            exact_rows = np.flatnonzero(self.alive)
+            if self.centroids is None:
+                rows = exact_rows
+            else:
+                n_probe = min(n_probe or self.n_probe, len(self.centroids))
+                probe = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+                rows = self._rows_of_lists(probe)
+                rows = rows[self.alive[rows]]
+            found_rows, scores = self._top(rows, query, k, threshold)
+            results = [(int(self.ids[row]), self.texts[row], float(score)) for row, score in zip(found_rows, scores)]
+
+            self.queries += 1
+            self.scanned += len(rows)
+            self._latencies.append(time.perf_counter() - started)
+            if rows is not exact_rows and self._rng.random() < self.recall_sample_rate:
+                expected, _ = self._top(exact_rows, query, k, threshold)
+                if len(expected):
+                    self._recalls.append(len(set(expected.tolist()) & set(found_rows.tolist())) / len(expected))
+        return results
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'size': len(self),
+                'deleted': int((~self.alive).sum()),
+                'trained': self.centroids is not None,
+                'lists': 0 if self.centroids is None else len(self.centroids),
+                'n_probe': self.n_probe,
+                'segments': len(self.segment_sizes),
+                'queries': self.queries,
+                'scanned_per_query': self.scanned / self.queries if self.queries else 0.0,
+                'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+                'latency_p95': latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+                'recall': sum(self._recalls) / len(self._recalls) if self._recalls else None,
+                'recall_samples': len(self._recalls)
+            }
+
+
+class VectorIndexes:
+    """
+    Named vector indexes of texts, each kept in its own subdirectory of directory.
+    """
+
+    NAME_PATTERN = re.compile(r'^[\w-]{1,100}$')
+
+    def __init__(self, embedding_cache, directory, **index_options):
+        self.embedding_cache = embedding_cache
+        self.directory = directory
+        self.index_options = index_options
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, create=False):
+        """
+        Returns the index, KeyError when it does not exist and create is False.
+        """
+        if not self.NAME_PATTERN.match(name):
+            raise ValueError(f'Invalid index name {name!r}, use letters, digits, _ and -')
+        with self._lock:
+            if name not in self._indexes:
+                path = os.path.join(self.directory, name)
+                if not create and not os.path.isdir(path):
+                    raise KeyError(name)
+                self._indexes[name] = VectorIndex(path, **self.index_options)
+            return self._indexes[name]
+
+    def add(self, name, texts):
+        return self.get(name, create=True).add(texts, self.embedding_cache.embed(texts))
+
+    def search(self, name, text, k=5, threshold=None):
+        return self.get(name).search(self.embedding_cache.embed([text])[0], k, threshold)
@@ -0,0 +1,62 @@
+# account_client.py
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ACCOUNT_SERVICES_URL = os.environ.get("ACCOUNT_SERVICES_URL", "http://127.0.0.1:5000")
+# (connect, read) timeouts in seconds
+ACCOUNT_SERVICES_TIMEOUT = (2.0, 10.0)
+
+
+class AccountServicesClient:
+    """
+    Client for the account services of restservice.py.
+
+    Keeps a pool of persistent connections, times out hung calls and retries
+    calls that could not connect with exponential backoff. fetch_context_async()
+    starts the call on a background thread so the caller can prepare the prompt
+    meanwhile.
+    """
+
+    def __init__(self, base_url: str = ACCOUNT_SERVICES_URL,
+                 timeout: tuple = ACCOUNT_SERVICES_TIMEOUT,
+                 retries: int = 3, backoff_factor: float = 0.2,
+                 pool_size: int = 10) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # only connection errors are retried: /processuserpmt carries out the
+        # request, e.g. a transfer, so a call that reached the server is never sent twice
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                      backoff_factor=backoff_factor)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size,
+                                            thread_name_prefix="account-services")
+
+    def fetch_context(self, prompt: str) -> str:
+        """
+        Resolve the user prompt with /processuserpmt and return the result text.
+        Raises requests.RequestException when the call fails or the reply has no result.
+        """
+        response = self.session.get(f"{self.base_url}/processuserpmt",
+                                    params={"prompt": prompt}, timeout=self.timeout)
+        response.raise_for_status()
+        reply = response.json()
+        if not isinstance(reply, dict) or "result" not in reply:
+            # reported like the transport errors, so callers have a single fallback
+            raise requests.RequestException(f"Unexpected reply from /processuserpmt: {reply!r}",
+                                            response=response)
+        return reply["result"]
+
+    def fetch_context_async(self, prompt: str) -> "Future[str]":
+        return self._executor.submit(self.fetch_context, prompt)
+
+
+# Shared by all sessions so the connection pool survives Streamlit reruns
+client = AccountServicesClient()
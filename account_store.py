@@ -0,0 +1,201 @@
+# account_store.py
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Set
+
+from intent_extractor import ACCOUNT_DATA_FILE
+
+# 'memory' keeps the account data in hash indexes, 'sqlite' in an indexed SQLite database at ACCOUNT_STORE_DB
+ACCOUNT_STORE = os.environ.get("ACCOUNT_STORE", "memory")
+ACCOUNT_STORE_DB = os.environ.get(
+    "ACCOUNT_STORE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_data.db"))
+
+# Payee status used when a payee has no entry in the store
+REGISTERED = "registered"
+
+
+def fold(name: str) -> str:
+    return name.strip().casefold()
+
+
+class AccountStore(ABC):
+    """
+    Users, payees and subscription products of the account services, looked up
+    by case-folded name.
+
+    Payees map to a status that decides the outcome of a transfer, e.g.
+    'unregistered', 'insufficient_funds' or 'recurring'.
+    """
+
+    @abstractmethod
+    def is_user(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def is_subscription(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def payee_status(self, name: str) -> str:
+        ...
+
+    @abstractmethod
+    def bulk_load(self, users: Iterable[str] = (), payees: Optional[Dict[str, str]] = None,
+                  subscriptions: Iterable[str] = ()) -> None:
+        """
+        Replace the contents of the store with the given users, payees and subscriptions.
+        """
+
+    def known_users(self, names: Iterable[str]) -> Set[str]:
+        """
+        Case-folded names of the given users that exist.
+        """
+        return {fold(name) for name in names if self.is_user(name)}
+
+    def known_subscriptions(self, names: Iterable[str]) -> Set[str]:
+        return {fold(name) for name in names if self.is_subscription(name)}
+
+    def payee_statuses(self, names: Iterable[str]) -> Dict[str, str]:
+        """
+        Status of the given payees that have an entry, by case-folded name.
+        """
+        statuses = {}
+        for name in names:
+            status = self.payee_status(name)
+            if status != REGISTERED:
+                statuses[fold(name)] = status
+        return statuses
+
+    def snapshot(self, users: Iterable[str] = (), payees: Iterable[str] = (),
+                 subscriptions: Iterable[str] = ()) -> "InMemoryAccountStore":
+        """
+        In-memory copy of just the given names, fetched with one bulk lookup
+        per kind, for resolving a batch of requests.
+        """
+        store = InMemoryAccountStore()
+        store.bulk_load(users=self.known_users(set(users)), payees=self.payee_statuses(set(payees)),
+                        subscriptions=self.known_subscriptions(set(subscriptions)))
+        return store
+
+    def load_file(self, path: str = ACCOUNT_DATA_FILE) -> "AccountStore":
+        with open(path) as data_file:
+            data = json.load(data_file)
+        self.bulk_load(users=data.get("users", []), payees=data.get("payees", {}),
+                       subscriptions=data.get("subscription_services", []))
+        return self
+
+
+class InMemoryAccountStore(AccountStore):
+
+    def __init__(self) -> None:
+        self.users: set = set()
+        self.subscriptions: set = set()
+        self.payees: Dict[str, str] = {}
+
+    def is_user(self, name: str) -> bool:
+        return fold(name) in self.users
+
+    def is_subscription(self, name: str) -> bool:
+        return fold(name) in self.subscriptions
+
+    def payee_status(self, name: str) -> str:
+        return self.payees.get(fold(name), REGISTERED)
+
+    def bulk_load(self, users: Iterable[str] = (), payees: Optional[Dict[str, str]] = None,
+                  subscriptions: Iterable[str] = ()) -> None:
+        self.users = {fold(user) for user in users}
+        self.subscriptions = {fold(subscription) for subscription in subscriptions}
+        self.payees = {fold(payee): status for payee, status in (payees or {}).items()}
+
+
+class SqliteAccountStore(AccountStore):
+    """
+    Account data in SQLite, for payee lists too large to keep in every worker.
+    Names are stored case-folded as primary keys, so lookups use the index.
+    """
+
+    def __init__(self, path: str = ACCOUNT_STORE_DB) -> None:
+        self.path = path
+        # one connection per thread, sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS users (name TEXT PRIMARY KEY) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS subscriptions (name TEXT PRIMARY KEY) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS payees (name TEXT PRIMARY KEY, status TEXT NOT NULL) WITHOUT ROWID;
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path)
+        return connection
+
+    def _exists(self, table: str, name: str) -> bool:
+        return self._connection().execute(
+            f"SELECT 1 FROM {table} WHERE name = ?", (fold(name),)).fetchone() is not None
+
+    def is_user(self, name: str) -> bool:
+        return self._exists("users", name)
+
+    def is_subscription(self, name: str) -> bool:
+        return self._exists("subscriptions", name)
+
+    def payee_status(self, name: str) -> str:
+        row = self._connection().execute(
+            "SELECT status FROM payees WHERE name = ?", (fold(name),)).fetchone()
+        return row[0] if row else REGISTERED
+
+    def _select_in(self, query: str, names: Iterable[str]) -> List[tuple]:
+        # chunked to stay below SQLite's limit on bound parameters
+        folded = sorted({fold(name) for name in names})
+        rows = []
+        for start in range(0, len(folded), 500):
+            chunk = folded[start:start + 500]
+            rows.extend(self._connection().execute(
+                query.format(placeholders=", ".join("?" * len(chunk))), chunk).fetchall())
+        return rows
+
+    def known_users(self, names: Iterable[str]) -> Set[str]:
+        return {row[0] for row in self._select_in(
+            "SELECT name FROM users WHERE name IN ({placeholders})", names)}
+
+    def known_subscriptions(self, names: Iterable[str]) -> Set[str]:
+        return {row[0] for row in self._select_in(
+            "SELECT name FROM subscriptions WHERE name IN ({placeholders})", names)}
+
+    def payee_statuses(self, names: Iterable[str]) -> Dict[str, str]:
+        return dict(self._select_in(
+            "SELECT name, status FROM payees WHERE name IN ({placeholders})", names))
+
+    def bulk_load(self, users: Iterable[str] = (), payees: Optional[Dict[str, str]] = None,
+                  subscriptions: Iterable[str] = ()) -> None:
+        # one transaction, other connections see either the old or the new data
+        with self._connection() as connection:
+            connection.execute("DELETE FROM users")
+            connection.execute("DELETE FROM subscriptions")
+            connection.execute("DELETE FROM payees")
+            connection.executemany("INSERT OR REPLACE INTO users VALUES (?)",
+                                   ((fold(user),) for user in users))
+            connection.executemany("INSERT OR REPLACE INTO subscriptions VALUES (?)",
+                                   ((fold(subscription),) for subscription in subscriptions))
+            connection.executemany("INSERT OR REPLACE INTO payees VALUES (?, ?)",
+                                   ((fold(payee), status) for payee, status in (payees or {}).items()))
+
+
+def create_store(backend: str = ACCOUNT_STORE, data_file: Optional[str] = ACCOUNT_DATA_FILE) -> AccountStore:
+    """
+    Create the configured store and bulk load the account data file into it.
+    """
+    if backend == "sqlite":
+        store: AccountStore = SqliteAccountStore()
+    elif backend == "memory":
+        store = InMemoryAccountStore()
+    else:
+        raise ValueError(f"Unknown account store {backend!r}, expected 'memory' or 'sqlite'")
+    if data_file:
+        store.load_file(data_file)
+    return store
@@ -1,18 +1,28 @@
 
 # app.py
-from typing import List, Union
+from typing import List, Optional, Union
 
 from dotenv import load_dotenv, find_dotenv
 from langchain.callbacks import get_openai_callback
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import (SystemMessage, HumanMessage, AIMessage)
 from langchain.llms import LlamaCpp
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.prompts import PromptTemplate
 import streamlit as st
 import requests
 import json
+import logging
+import uuid
+
+from model_registry import registry as model_registry
+import session_cache
+from context_window import ContextWindow
+from streaming import StreamlitTokenHandler
+import inference_worker
+from inference_worker import QueueFullError
+from account_client import client as account_services
+from response_cache import answer_cache
+import guardrails
 
 PROMPT_TEMPLATE = """
 Use the following pieces of context enclosed by triple backquotes to answer the question at the end.
@@ -26,6 +36,13 @@ Question: [][][][]{question}[][][][]
 \n
 Answer:"""
 
+# Prompt tokens allowed for the chat history, 0 uses the model context size minus ANSWER_TOKEN_RESERVE
+HISTORY_TOKEN_BUDGET = 0
+ANSWER_TOKEN_RESERVE = 256
+# Requests waiting for the shared model across all sessions, and how long one may take in total
+INFERENCE_QUEUE_SIZE = 16
+INFERENCE_TIMEOUT_SECONDS = 180
+
 # with_rag=False
 
 def init_page() -> None:
@@ -44,6 +61,8 @@ def init_messages() -> None:
                 content="You are a helpful AI assistant. Reply your answer in mardkown format.")
         ]
         st.session_state.costs = []
+        # a new conversation id so the cached llama.cpp state of the cleared one is not reused
+        st.session_state.conversation_id = str(uuid.uuid4())
 
 
 def select_llm() -> Union[ChatOpenAI, LlamaCpp]:
@@ -64,25 +83,99 @@ def select_llm() -> Union[ChatOpenAI, LlamaCpp]:
     if model_name.startswith("gpt-"):
         return ChatOpenAI(temperature=temperature, model_name=model_name)
     elif model_name.startswith("llama-2-"):
-        callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
-        return LlamaCpp(
-            model_path=f"./models/{model_name}.bin",
-            input={"temperature": temperature,
-                   "max_length": 2000,
-                   "top_p": 1
-                   },
-            callback_manager=callback_manager,
+        # Served from the process-wide registry so the GGUF is read from disk
+        # once and shared by every rerun and browser session. Tokens are
+        # streamed to the chat UI with per-answer callbacks, see get_answer()
+        return model_registry.get(
+            f"./models/{model_name}.bin",
+            temperature=temperature,
+            max_tokens=2000,
+            top_p=1,
             verbose=False,  # True
         )
 
 
-def get_answer(llm, messages) -> tuple[str, float]:
+def show_model_stats(llm) -> None:
+    """
+    Show load time and memory footprint of the resident models, and the
+    request queue of the current one, in the sidebar.
+    """
+    for stats in model_registry.stats():
+        st.sidebar.caption(
+            f"Model loaded in {stats['load_seconds']:.1f}s "
+            f"({stats['file_mb']:.0f} MB on disk, "
+            f"+{stats['rss_delta_mb']:.0f} MB RSS)")
+    if isinstance(llm, LlamaCpp):
+        stats = get_worker(llm).stats()
+        st.sidebar.caption(
+            f"{stats['queue_depth']} requests waiting, "
+            f"p95 queue wait {stats['wait_p95']:.1f}s")
+    cache_stats = answer_cache.stats()
+    if cache_stats["entries"]:
+        st.sidebar.caption(f"Answer cache hit rate {cache_stats['hit_rate']:.0%} "
+                           f"({cache_stats['entries']} answers)")
+
+
+def show_answer_metrics(metrics: dict) -> None:
+    """
+    Record the latency of the last answer and show it in the sidebar.
+    """
+    st.session_state.setdefault("answer_metrics", []).append(metrics)
+    if metrics["time_to_first_token"] is not None:
+        st.sidebar.caption(f"First token after {metrics['time_to_first_token']:.2f}s")
+    if metrics["tokens_per_sec"] is not None:
+        st.sidebar.caption(f"{metrics['tokens']} tokens at {metrics['tokens_per_sec']:.1f} tokens/sec")
+
+
+def get_worker(llm: LlamaCpp) -> inference_worker.InferenceWorker:
+    return inference_worker.for_model(llm, max_pending=INFERENCE_QUEUE_SIZE,
+                                      timeout=INFERENCE_TIMEOUT_SECONDS)
+
+
+def is_deterministic(llm) -> bool:
+    """
+    Answers can only be reused if the same prompt always generates the same answer.
+    """
+    return isinstance(llm, LlamaCpp) and llm.temperature == 0.0
+
+
+def context_window(llm: LlamaCpp) -> ContextWindow:
+    return ContextWindow(llm.get_num_tokens,
+                         HISTORY_TOKEN_BUDGET or llm.n_ctx - ANSWER_TOKEN_RESERVE)
+
+
+def fit_messages(llm: LlamaCpp, messages,
+                 window: Optional[ContextWindow] = None) -> List[dict]:
+    """
+    The messages sent to the model, the chat history fitted into the context window.
+    """
+    return (window or context_window(llm)).fit(convert_langchainschema_to_dict(messages))
+
+
+def get_answer(llm, messages, conversation_id: str = "",
+               callbacks: Optional[list] = None,
+               stop_hooks: Optional[list] = None,
+               fitted_messages: Optional[List[dict]] = None) -> tuple[str, float]:
     if isinstance(llm, ChatOpenAI):
         with get_openai_callback() as cb:
-            answer = llm(messages)
+            answer = llm(messages, callbacks=callbacks)
         return answer.content, cb.total_cost
     if isinstance(llm, LlamaCpp):
-        return llm(llama_v2_prompt(convert_langchainschema_to_dict(messages))), 0.0
+        # callers that already fitted the messages pass them in fitted_messages
+        prompt = llama_v2_prompt(fitted_messages or fit_messages(llm, messages))
+        # Restores the llama.cpp state of the previous turn so only the new part of the prompt is evaluated
+        cache = session_cache.for_model(llm) if conversation_id else None
+
+        def generate(worker_callbacks: list) -> str:
+            if cache is None:
+                return llm(prompt, callbacks=worker_callbacks)
+            return cache.generate(llm, conversation_id, prompt, callbacks=worker_callbacks)
+
+        # The worker thread owns the model and schedules the sessions fairly,
+        # generated tokens are handed back to this thread for the callbacks.
+        # Stop hooks run next to the model and can end the generation early
+        return get_worker(llm).run(conversation_id, generate, callbacks,
+                                   stop_hooks=stop_hooks), 0.0
 
 
 def find_role(message: Union[SystemMessage, HumanMessage, AIMessage]) -> str:
@@ -152,11 +245,15 @@ def extract_userquesion_part_only(content):
         return content_split[1]
     return content
 
-def process_llm_output(rest_response,llm_response) -> str:
-   
-    processed_output=''
-    if((llm_response.upper().find('HOWEVER') > -1) or (llm_response.upper().find('JUST AN AI') > -1) or (llm_response.upper().find('PROPER AUTHORIZATION') > -1) or (llm_response.upper().find('CONSENT') > -1) or
-     (llm_response.upper().find('ETHICAL') > -1) or (llm_response.upper().find('SECURITY') > -1) or (llm_response.upper().find('CAN YOU') > -1) or (llm_response.upper().find('PLEASE PROVIDE') > -1)): 
+def process_llm_output(rest_response,llm_response,refusal: Optional[str] = None) -> str:
+    """
+    Fall back to the account services response when the LLM answer contains a
+    refusal phrase from guardrails.json. refusal is the phrase already found
+    while the answer was streamed, the answer is only scanned when it is None.
+    """
+    if refusal is None:
+        refusal = guardrails.matcher.search(llm_response)
+    if refusal:
         processed_output=f'{rest_response} \n Hope I have fulfilled your request. Is there anything else I can do for you?'
     else:
         processed_output=f'{llm_response} \n Hope I have fulfilled your request. Is there anything else I can do for you?'
@@ -168,19 +265,46 @@ def main() -> None:
 
     init_page()
     llm = select_llm()
+    show_model_stats(llm)
     init_messages()
 
     with_rag = st.sidebar.checkbox("## Use RAG ", False)
+    user_input = st.chat_input("Input your question!")
+    if user_input and with_rag:
+        # call account services in the background while the chat history is
+        # rendered and its tokens are counted for the context window
+        context_future = account_services.fetch_context_async(user_input)
+
+    # Display chat history
+    messages = st.session_state.get("messages", [])
+    for message in messages:
+        if isinstance(message, AIMessage):
+            with st.chat_message("assistant"):
+                st.markdown(message.content)
+        elif isinstance(message, HumanMessage):
+            with st.chat_message("user"):
+                st.markdown(extract_userquesion_part_only(message.content))
+
     # Supervise user input
     text_context=''
-    if user_input := st.chat_input("Input your question!"):
-        
+    if user_input:
+        window = None
+        if isinstance(llm, LlamaCpp):
+            window = context_window(llm)
+            window.prepare(convert_langchainschema_to_dict(st.session_state.messages))
+
+        with st.chat_message("user"):
+            st.markdown(user_input)
+
+        if(with_rag):
+            try:
+                text_context = context_future.result()
+                logging.debug(f"Account services context: {text_context}")
+            except requests.RequestException as e:
+                st.warning(f"Account services are not available, answering without them. ({e})")
+                with_rag = False
+
         if(with_rag):
-            #call account services
-            accountservices_url = f'http://127.0.0.1:5000/processuserpmt?prompt={user_input}'
-            json_result = requests.get(accountservices_url).json()
-            print(json_result)
-            text_context = json_result['result']
             user_input_w_context = PromptTemplate(
                 template=PROMPT_TEMPLATE,
                 input_variables=["context", "question"]) \
@@ -191,26 +315,44 @@ def main() -> None:
         else: 
             st.session_state.messages.append(HumanMessage(content=user_input))
 
-        with st.spinner("AI Assistant is typing ..."):
-            answer, cost = get_answer(llm, st.session_state.messages)
-        # Removed post processing hack with the fine tuned model - Ahilan 12/24
-        #if(with_rag):
-        #    revised_answer=process_llm_output(text_context,answer)
-        #else:
-        #    revised_answer=answer
-        revised_answer=answer
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            placeholder.markdown("AI Assistant is typing ...")
+            # tokens are pushed into the placeholder as llama.cpp generates them
+            token_handler = StreamlitTokenHandler(placeholder)
+            # at temperature zero the same question with the same account services
+            # context gets the same answer, so common requests skip the model
+            use_cache = with_rag and is_deterministic(llm)
+            fitted_messages = fit_messages(llm, st.session_state.messages, window) if window else None
+            # the earlier turns the model sees are part of the prompt, so they are part of the key
+            history = fitted_messages[:-1] if use_cache else []
+            answer = answer_cache.get(llm.model_path, user_input, text_context, history) if use_cache else None
+            if answer is not None:
+                cost = 0.0
+            else:
+                try:
+                    answer, cost = get_answer(llm, st.session_state.messages,
+                                              st.session_state.conversation_id,
+                                              callbacks=[token_handler],
+                                              fitted_messages=fitted_messages)
+                except (QueueFullError, TimeoutError) as e:
+                    st.session_state.messages.pop()
+                    placeholder.error(f"The AI Assistant is busy, please try again in a moment. ({e})")
+                    st.stop()
+                if use_cache:
+                    answer_cache.put(llm.model_path, user_input, text_context, answer, history)
+            # Removed post processing hack with the fine tuned model - Ahilan 12/24
+            #if(with_rag):
+            #    revised_answer=process_llm_output(text_context,answer)
+            #else:
+            #    revised_answer=answer
+            revised_answer=answer
+            placeholder.markdown(revised_answer)
+
         st.session_state.messages.append(AIMessage(content=revised_answer))
         st.session_state.costs.append(cost)
+        show_answer_metrics(token_handler.metrics())
 
-    # Display chat history
-    messages = st.session_state.get("messages", [])
-    for message in messages:
-        if isinstance(message, AIMessage):
-            with st.chat_message("assistant"):
-                st.markdown(message.content)
-        elif isinstance(message, HumanMessage):
-            with st.chat_message("user"):
-                st.markdown(extract_userquesion_part_only(message.content))
     # Removed cost display from sidebar leaving the cost calculation for future reference - Ahilan 12/12/23 
     #costs = st.session_state.get("costs", [])
     #st.sidebar.markdown("## Costs")
@@ -0,0 +1,262 @@
+# benchmark.py
+"""
+Headless benchmark of the chat assistant.
+
+Replays the conversations of a JSONL file through the same steps as app.py /
+app-ft.py (select_llm(), the /processuserpmt RAG call, the answer cache,
+get_answer() with its inference worker, session state cache and refusal stop
+hook, and process_llm_output()) and reports prompt-eval time,
+time-to-first-token, tokens/sec, RAG latency, answer cache hits and turn
+latency percentiles per app. The refusal stop hook and process_llm_output()
+are applied to the RAG answers of every app so the apps are compared on the
+same work. --direct calls the model without get_answer() and the answer
+cache, as does --stub, whose stand-in model the inference worker cannot run.
+
+    python3 benchmark.py --app app.py --app app-ft.py
+    python3 benchmark.py --app app.py --model-path ./models/base.gguf --app app-ft.py --model-path ./models/ft.gguf
+    python3 benchmark.py --model-path ./models/tiny.gguf --no-rag
+    python3 benchmark.py --stub --no-rag
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, List, Optional
+
+from langchain.schema import SystemMessage, HumanMessage, AIMessage
+from langchain.prompts import PromptTemplate
+
+import guardrails
+from account_client import AccountServicesClient
+from streaming import StreamlitTokenHandler
+
+SYSTEM_PROMPT = "You are a helpful AI assistant. Reply your answer in mardkown format."
+
+
+class StubLlm:
+    """
+    Stand-in for LlamaCpp that needs no model file. Prompt evaluation and token
+    generation sleep at fixed rates, so the rest of the pipeline can be
+    measured offline.
+    """
+
+    def __init__(self, model_path: str = "stub", n_ctx: int = 2048,
+                 prompt_tokens_per_sec: float = 400.0, tokens_per_sec: float = 20.0,
+                 answer_tokens: int = 40) -> None:
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+
+    def get_num_tokens(self, text: str) -> int:
+        return max(len(text) // 4, 1)
+
+    def __call__(self, prompt: str, callbacks: Optional[list] = None) -> str:
+        time.sleep(self.get_num_tokens(prompt) / self.prompt_tokens_per_sec)
+        answer = ""
+        for i in range(self.answer_tokens):
+            time.sleep(1.0 / self.tokens_per_sec)
+            token = " done" if i == self.answer_tokens - 1 else " ok"
+            answer += token
+            for handler in callbacks or []:
+                handler.on_llm_new_token(token)
+        for handler in callbacks or []:
+            handler.on_llm_end(answer)
+        return answer
+
+
+def load_app(path: str) -> Any:
+    """
+    Import app.py / app-ft.py as a module without running the Streamlit UI.
+    """
+    name = "bench_" + os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reset_llama_timings(llm: Any) -> None:
+    try:
+        import llama_cpp
+        llama_cpp.llama_reset_timings(llm.client._ctx.ctx)
+    except Exception:
+        pass
+
+
+def llama_prompt_eval_seconds(llm: Any) -> Optional[float]:
+    """
+    Prompt evaluation time of the last generation as measured by llama.cpp,
+    None for stub models or llama-cpp-python builds without timings.
+    """
+    try:
+        import llama_cpp
+        return llama_cpp.llama_get_timings(llm.client._ctx.ctx).t_p_eval_ms / 1000.0
+    except Exception:
+        return None
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return values[min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+def run_turn(app: Any, llm: Any, messages: list, turn: dict,
+             account_services: Optional[AccountServicesClient],
+             conversation_id: str = "", direct: bool = False, use_answer_cache: bool = True) -> dict:
+    """
+    Answer one turn like app.main() does, or with direct by calling the model itself.
+    """
+    started = time.perf_counter()
+    text_context = ""
+    rag_seconds = None
+    with_rag = turn.get("rag", False) and account_services is not None
+    if with_rag:
+        rag_started = time.perf_counter()
+        try:
+            text_context = account_services.fetch_context(turn["user"])
+        except Exception as e:
+            print(f"RAG call failed: {e}", file=sys.stderr)
+            with_rag = False
+        rag_seconds = time.perf_counter() - rag_started
+
+    if with_rag:
+        content = PromptTemplate(template=app.PROMPT_TEMPLATE,
+                                 input_variables=["context", "question"]) \
+            .format(context=text_context, question=turn["user"])
+    else:
+        content = turn["user"]
+    messages.append(HumanMessage(content=content))
+
+    fitted_messages = app.fit_messages(llm, messages)
+    prompt = app.llama_v2_prompt(fitted_messages)
+
+    handler = StreamlitTokenHandler()
+    reset_llama_timings(llm)
+    answer = None
+    streamed_refusal = None
+    use_cache = use_answer_cache and not direct and with_rag and app.is_deterministic(llm)
+    if use_cache:
+        answer = app.answer_cache.get(llm.model_path, turn["user"], text_context, fitted_messages[:-1])
+    cache_hit = answer is not None
+    if direct:
+        answer = llm(prompt, callbacks=[handler])
+    elif not cache_hit:
+        refusal_watcher = guardrails.RefusalWatcher(guardrails.matcher.scanner()) if with_rag else None
+        answer, _ = app.get_answer(llm, messages, conversation_id, callbacks=[handler],
+                                   stop_hooks=[refusal_watcher] if refusal_watcher else None,
+                                   fitted_messages=fitted_messages)
+        if refusal_watcher is not None:
+            streamed_refusal = refusal_watcher.matched or ""
+        if use_cache:
+            app.answer_cache.put(llm.model_path, turn["user"], text_context, answer, fitted_messages[:-1])
+    answer = app.process_llm_output(text_context, answer, streamed_refusal) if with_rag else answer
+    messages.append(AIMessage(content=answer))
+
+    metrics = handler.metrics()
+    return {"prompt_tokens": llm.get_num_tokens(prompt),
+            "prompt_eval_seconds": None if cache_hit else llama_prompt_eval_seconds(llm),
+            "time_to_first_token": (handler.first_token_at - started) if handler.first_token_at else None,
+            "tokens_per_sec": metrics["tokens_per_sec"],
+            "tokens": metrics["tokens"],
+            "rag_seconds": rag_seconds,
+            "cache_hit": cache_hit,
+            "turn_seconds": time.perf_counter() - started,
+            }
+
+
+def summarize(name: str, turns: List[dict]) -> dict:
+    summary = {"name": name, "turns": len(turns)}
+    for key in ("prompt_eval_seconds", "time_to_first_token", "rag_seconds", "turn_seconds"):
+        values = [turn[key] for turn in turns]
+        summary[key] = {"p50": percentile(values, 50),
+                        "p95": percentile(values, 95),
+                        "p99": percentile(values, 99)}
+    rates = [turn["tokens_per_sec"] for turn in turns if turn["tokens_per_sec"]]
+    summary["tokens_per_sec"] = sum(rates) / len(rates) if rates else None
+    summary["cache_hits"] = sum(turn["cache_hit"] for turn in turns)
+    return summary
+
+
+def print_summary(summary: dict) -> None:
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    print(f"\n{summary['name']} ({summary['turns']} turns)")
+    for key in ("prompt_eval_seconds", "time_to_first_token", "rag_seconds", "turn_seconds"):
+        stats = summary[key]
+        print(f"  {key:<22} p50 {fmt(stats['p50'])}s  p95 {fmt(stats['p95'])}s  p99 {fmt(stats['p99'])}s")
+    print(f"  {'tokens_per_sec':<22} {fmt(summary['tokens_per_sec'])}")
+    print(f"  {'cache_hits':<22} {summary['cache_hits']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the chat assistant end-to-end")
+    parser.add_argument("--conversations", default="benchmarks/conversations.jsonl")
+    parser.add_argument("--app", action="append",
+                        help="app module to benchmark, can be repeated (default: app.py and app-ft.py)")
+    parser.add_argument("--model-path", action="append",
+                        help="use this GGUF instead of the model chosen by select_llm(), once for all "
+                             "apps or once per --app in the same order")
+    parser.add_argument("--stub", action="store_true", help="use a stub model instead of llama.cpp")
+    parser.add_argument("--direct", action="store_true",
+                        help="call the model directly instead of through get_answer() and the answer cache")
+    parser.add_argument("--no-answer-cache", action="store_true",
+                        help="generate every answer, e.g. to measure the model with --repeat")
+    parser.add_argument("--no-rag", action="store_true", help="skip the /processuserpmt calls")
+    parser.add_argument("--account-services-url", default=None)
+    parser.add_argument("--repeat", type=int, default=1, help="replay the conversations this many times")
+    parser.add_argument("--output", help="write the per-turn results and summaries to this JSON file")
+    args = parser.parse_args()
+    app_paths = args.app or ["app.py", "app-ft.py"]
+    model_paths = args.model_path or []
+    if len(model_paths) not in (0, 1, len(app_paths)):
+        parser.error(f"give --model-path once or once per app ({len(app_paths)} apps)")
+
+    with open(args.conversations) as conversations_file:
+        conversations = [json.loads(line) for line in conversations_file if line.strip()]
+
+    account_services = None
+    if not args.no_rag:
+        account_services = AccountServicesClient(args.account_services_url) \
+            if args.account_services_url else AccountServicesClient()
+
+    results = []
+    for i, app_path in enumerate(app_paths):
+        app = load_app(app_path)
+        if args.stub:
+            llm = StubLlm(model_path=f"stub:{app_path}")
+        elif model_paths:
+            llm = app.model_registry.get(model_paths[i] if len(model_paths) > 1 else model_paths[0],
+                                         temperature=0.0, max_tokens=256, top_p=1, verbose=False)
+        else:
+            llm = app.select_llm()
+
+        turns = []
+        for _ in range(args.repeat):
+            for conversation in conversations:
+                messages = [SystemMessage(content=SYSTEM_PROMPT)]
+                # a conversation id per replay, like a new chat in the UI
+                conversation_id = str(uuid.uuid4())
+                for turn in conversation["turns"]:
+                    turns.append(run_turn(app, llm, messages, turn, account_services, conversation_id,
+                                          direct=args.direct or args.stub,
+                                          use_answer_cache=not args.no_answer_cache))
+
+        summary = summarize(f"{app_path} [{getattr(llm, 'model_path', '')}]", turns)
+        print_summary(summary)
+        results.append({"summary": summary, "turns": turns})
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
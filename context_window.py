@@ -0,0 +1,84 @@
+# context_window.py
+from typing import Callable, Dict, List
+
+# Marker the chat apps put around the user question inside PROMPT_TEMPLATE
+QUESTION_MARKER = "[][][][]"
+# Approximate Llama2 formatting tokens added per message ([INST], [/INST], <s>, </s>)
+MESSAGE_OVERHEAD_TOKENS = 8
+
+
+def is_rag_message(message: dict) -> bool:
+    return message["role"] == "user" and message["content"].count(QUESTION_MARKER) == 2
+
+
+def summarize_rag_message(message: dict) -> dict:
+    """
+    Replace a user message built from PROMPT_TEMPLATE with its question and the
+    first sentence of its context.
+    """
+    before, question, _ = message["content"].split(QUESTION_MARKER)
+    context = before.split("```")[1].strip() if before.count("```") >= 2 else ""
+    summary = context.split("\n")[0].split(". ")[0].strip()
+    content = f"{question.strip()}\n(Context: {summary})" if summary else question.strip()
+    return {"role": message["role"], "content": content}
+
+
+class ContextWindow:
+    """
+    Keeps the chat history sent to the model within a token budget.
+
+    The system prompt and the latest user message are always kept. When the
+    history is over budget the RAG context blocks of older turns are
+    summarized first, then the oldest question/answer pairs are dropped.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], budget: int) -> None:
+        self.count_tokens = count_tokens
+        self.budget = budget
+        # token counts by message content, a window is used for a single turn
+        self._token_counts: Dict[str, int] = {}
+
+    def message_tokens(self, message: dict) -> int:
+        content = message["content"]
+        if content not in self._token_counts:
+            self._token_counts[content] = self.count_tokens(content)
+        return self._token_counts[content] + MESSAGE_OVERHEAD_TOKENS
+
+    def prepare(self, messages: List[dict]) -> None:
+        """
+        Count the tokens of the chat history, and of the summaries fit() may
+        replace its RAG messages with, ahead of fit().
+        """
+        for message in messages:
+            self.message_tokens(message)
+            if is_rag_message(message):
+                self.message_tokens(summarize_rag_message(message))
+
+    def total_tokens(self, messages: List[dict]) -> int:
+        return sum(self.message_tokens(message) for message in messages)
+
+    def fit(self, messages: List[dict]) -> List[dict]:
+        """
+        Return the messages to send, in the list of dictionary format used by
+        llama_v2_prompt().
+        """
+        if self.total_tokens(messages) <= self.budget or len(messages) < 2:
+            return messages
+
+        head = messages[:1] if messages[0]["role"] == "system" else []
+        history, latest = messages[len(head):-1], messages[-1]
+
+        history = [summarize_rag_message(message) if is_rag_message(message) else message
+                   for message in history]
+
+        # Drop whole question/answer pairs so user and assistant keep alternating
+        available = self.budget - self.total_tokens(head) - self.message_tokens(latest)
+        history_tokens = [self.message_tokens(message) for message in history]
+        used = sum(history_tokens)
+        start = 0
+        while start < len(history) and used > available:
+            used -= sum(history_tokens[start:start + 2])
+            start += 2
+        history = history[start:]
+
+        return head + history + [latest]
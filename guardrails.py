@@ -0,0 +1,88 @@
+# guardrails.py
+import json
+import os
+import re
+from typing import Any, Iterable, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from inference_worker import GenerationStopped
+
+GUARDRAILS_CONFIG = os.environ.get(
+    "GUARDRAILS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "guardrails.json"))
+
+
+class GuardrailMatcher:
+    """
+    Finds refusal phrases in LLM output with a single case-insensitive regex
+    alternation, so the text is scanned once however many phrases are configured.
+    """
+
+    def __init__(self, phrases: Iterable[str]) -> None:
+        self.phrases = sorted({phrase.upper() for phrase in phrases if phrase}, key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(phrase) for phrase in self.phrases), re.IGNORECASE) \
+            if self.phrases else None
+        self.max_phrase_length = len(self.phrases[0]) if self.phrases else 0
+
+    @classmethod
+    def from_file(cls, path: str = GUARDRAILS_CONFIG) -> "GuardrailMatcher":
+        with open(path) as config_file:
+            return cls(json.load(config_file)["refusal_phrases"])
+
+    def search(self, text: str) -> Optional[str]:
+        """
+        Return the first refusal phrase found in the text, upper cased, or None.
+        """
+        if self.pattern is None:
+            return None
+        match = self.pattern.search(text)
+        return match.group(0).upper() if match else None
+
+    def scanner(self) -> "StreamScanner":
+        return StreamScanner(self)
+
+
+class StreamScanner:
+    """
+    Incremental matcher for streamed output. Each token is scanned together with
+    just enough of the preceding text to catch phrases split across tokens.
+    """
+
+    def __init__(self, matcher: GuardrailMatcher) -> None:
+        self.matcher = matcher
+        self.matched: Optional[str] = None
+        self._tail = ""
+
+    def feed(self, token: str) -> Optional[str]:
+        if self.matched is None:
+            window = self._tail + token
+            self.matched = self.matcher.search(window)
+            keep = self.matcher.max_phrase_length - 1
+            self._tail = window[-keep:] if keep > 0 else ""
+        return self.matched
+
+
+class RefusalWatcher(BaseCallbackHandler):
+    """
+    Stop condition for the generation: watches the token stream for refusal
+    phrases and raises GenerationStopped as soon as the first one appears, so
+    llama.cpp stops decoding an answer that will be replaced anyway.
+    """
+
+    # let GenerationStopped end the generation instead of being logged by LangChain
+    raise_error = True
+
+    def __init__(self, scanner: StreamScanner) -> None:
+        self.scanner = scanner
+
+    @property
+    def matched(self) -> Optional[str]:
+        return self.scanner.matched
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.scanner.feed(token):
+            raise GenerationStopped(f"Refusal phrase {self.scanner.matched!r} in the answer")
+
+
+# Loaded once per process, shared by all sessions
+matcher = GuardrailMatcher.from_file()
@@ -0,0 +1,61 @@
+# gunicorn.conf.py
+# Production serving settings for restservice.py, used by
+#   gunicorn -c gunicorn.conf.py restservice:app
+# or RESTSERVICE_MODE=production python3 restservice.py
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"{os.environ.get('RESTSERVICE_HOST', '127.0.0.1')}:{os.environ.get('RESTSERVICE_PORT', '5000')}"
+
+# threaded workers, requests mostly wait on I/O and the account store lookups are cheap
+workers = int(os.environ.get('RESTSERVICE_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('RESTSERVICE_THREADS', 4))
+
+# import restservice once in the master and fork the workers from it, so the
+# account data is bulk loaded once instead of by every worker at the same time
+# (concurrent loads into one SQLite database fail with "database is locked"),
+# and the NLTK tagger is shared copy-on-write
+preload_app = True
+
+# keep connections from the chat assistant's connection pool open between turns
+keepalive = 15
+timeout = 30
+# on SIGTERM workers finish the requests in flight for up to this many seconds
+graceful_timeout = 30
+
+# recycle workers now and then to bound memory growth
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = '-'
+errorlog = '-'
+
+# each worker writes its metrics to METRICS_DIR and /metrics sums them, so
+# whichever worker answers a scrape reports the totals of all workers
+# (a temporary directory of this run unless METRICS_DIR is set)
+temporary_metrics_dir = 'METRICS_DIR' not in os.environ
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'restservice-metrics-{os.getpid()}'))
+
+
+def on_starting(server):
+    from service_metrics import clear_metrics_dir
+    clear_metrics_dir(os.environ['METRICS_DIR'])
+
+
+def worker_exit(server, worker):
+    # runs in the exiting worker, write its last counts before the master archives them
+    from restservice import metrics
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    from service_metrics import archive_worker
+    archive_worker(os.environ['METRICS_DIR'], worker.pid)
+
+
+def on_exit(server):
+    if temporary_metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
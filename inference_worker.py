@@ -0,0 +1,214 @@
+# inference_worker.py
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+class QueueFullError(RuntimeError):
+    """
+    Raised when the worker already has the maximum number of pending requests.
+    """
+
+
+class GenerationCancelled(RuntimeError):
+    """
+    Raised inside the generation when its caller gave up waiting.
+    """
+
+
+class GenerationStopped(RuntimeError):
+    """
+    Raised by a stop hook to end the generation early, the text generated so
+    far becomes the answer.
+    """
+
+
+class InferenceRequest:
+
+    def __init__(self, session_id: str, fn: Callable[[list], Any], timeout: float,
+                 stop_hooks: Optional[List[BaseCallbackHandler]] = None) -> None:
+        self.session_id = session_id
+        self.fn = fn
+        self.stop_hooks = stop_hooks or []
+        self.submitted_at = time.perf_counter()
+        self.deadline = self.submitted_at + timeout
+        self.started_at: Optional[float] = None
+        # ("token", text), ("done", result), ("stopped", exception) or
+        # ("error", exception), consumed by the caller
+        self.events: "queue.Queue[tuple]" = queue.Queue()
+        self.cancelled = threading.Event()
+
+
+class TokenRelay(BaseCallbackHandler):
+    """
+    Runs on the worker thread and hands generated tokens to the waiting caller,
+    Streamlit elements can only be updated from the session's own thread.
+    """
+
+    # let GenerationCancelled stop llama.cpp instead of being logged by LangChain
+    raise_error = True
+
+    def __init__(self, request: InferenceRequest) -> None:
+        self.request = request
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.request.cancelled.is_set():
+            raise GenerationCancelled("Caller stopped waiting for the answer")
+        self.request.events.put(("token", token))
+
+
+class InferenceWorker:
+    """
+    Single model server in front of a LlamaCpp model.
+
+    All generations run on one worker thread, so the model is never used
+    concurrently. Pending requests are kept per session and served round
+    robin, so one busy session cannot starve the others. The number of
+    pending requests is bounded and every request has a deadline; requests
+    still queued at their deadline are dropped and running ones are cancelled
+    at the next token. Stop hooks are callbacks that run on the worker thread
+    next to the model and end the generation early by raising GenerationStopped.
+    """
+
+    def __init__(self, max_pending: int = 16, timeout: float = 180.0) -> None:
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pending: "OrderedDict[str, Deque[InferenceRequest]]" = OrderedDict()
+        self._pending_count = 0
+        self._condition = threading.Condition()
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+        self.completed = 0
+        self.stopped = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self._thread = threading.Thread(target=self._serve, name="inference-worker", daemon=True)
+        self._thread.start()
+
+    def run(self, session_id: str, fn: Callable[[list], Any],
+            callbacks: Optional[List[BaseCallbackHandler]] = None,
+            timeout: Optional[float] = None,
+            stop_hooks: Optional[List[BaseCallbackHandler]] = None) -> Any:
+        """
+        Queue fn for the worker and wait for its result. fn receives the
+        callbacks to pass to the model; tokens it generates are forwarded to
+        callbacks on the calling thread. If a stop hook ends the generation,
+        the text generated until then is returned.
+        """
+        request = self.submit(session_id, fn, timeout, stop_hooks)
+        text = ""
+        while True:
+            remaining = request.deadline - time.perf_counter()
+            try:
+                kind, value = request.events.get(timeout=max(remaining, 0.0))
+            except queue.Empty:
+                request.cancelled.set()
+                raise TimeoutError(
+                    f"No answer within {request.deadline - request.submitted_at:.0f}s")
+            if kind == "token":
+                text += value
+                for handler in callbacks or []:
+                    handler.on_llm_new_token(value)
+            elif kind == "stopped":
+                for handler in callbacks or []:
+                    handler.on_llm_end(text)
+                return text
+            elif kind == "done":
+                for handler in callbacks or []:
+                    handler.on_llm_end(value)
+                return value
+            else:
+                for handler in callbacks or []:
+                    handler.on_llm_error(value)
+                raise value
+
+    def submit(self, session_id: str, fn: Callable[[list], Any],
+               timeout: Optional[float] = None,
+               stop_hooks: Optional[List[BaseCallbackHandler]] = None) -> InferenceRequest:
+        request = InferenceRequest(session_id, fn, self.timeout if timeout is None else timeout,
+                                   stop_hooks)
+        with self._condition:
+            if self._pending_count >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"{self._pending_count} requests are already waiting for the model")
+            self._pending.setdefault(session_id, deque()).append(request)
+            self._pending_count += 1
+            self._condition.notify()
+        return request
+
+    def stats(self) -> dict:
+        """
+        Queue depth and queue wait times in seconds.
+        """
+        with self._condition:
+            wait_times = sorted(self._wait_times)
+            queue_depth = self._pending_count
+        return {"queue_depth": queue_depth,
+                "wait_avg": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+                "wait_p95": wait_times[int(0.95 * (len(wait_times) - 1))] if wait_times else 0.0,
+                "wait_max": wait_times[-1] if wait_times else 0.0,
+                "completed": self.completed,
+                "stopped": self.stopped,
+                "failed": self.failed,
+                "timed_out": self.timed_out,
+                "rejected": self.rejected,
+                }
+
+    def _next_request(self) -> InferenceRequest:
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            # round robin: take the oldest request of the session at the front,
+            # then move that session behind the others
+            session_id, requests = next(iter(self._pending.items()))
+            request = requests.popleft()
+            del self._pending[session_id]
+            if requests:
+                self._pending[session_id] = requests
+            self._pending_count -= 1
+            return request
+
+    def _serve(self) -> None:
+        while True:
+            request = self._next_request()
+            request.started_at = time.perf_counter()
+            if request.cancelled.is_set() or request.started_at > request.deadline:
+                self.timed_out += 1
+                continue
+            with self._condition:
+                self._wait_times.append(request.started_at - request.submitted_at)
+            try:
+                # the relay goes first so the token that triggers a stop hook still reaches the caller
+                result = request.fn([TokenRelay(request)] + request.stop_hooks)
+            except GenerationCancelled:
+                self.timed_out += 1
+            except GenerationStopped as e:
+                self.stopped += 1
+                request.events.put(("stopped", e))
+            except Exception as e:
+                self.failed += 1
+                request.events.put(("error", e))
+            else:
+                self.completed += 1
+                request.events.put(("done", result))
+
+
+# One worker per resident model, kept at module level so it survives Streamlit reruns
+_workers: Dict[int, InferenceWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def for_model(llm: Any, **options: Any) -> InferenceWorker:
+    """
+    Return the inference worker of a model, starting it on first use.
+    """
+    with _workers_lock:
+        worker = _workers.get(id(llm))
+        if worker is None:
+            worker = _workers[id(llm)] = InferenceWorker(**options)
+        return worker
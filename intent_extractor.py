@@ -0,0 +1,99 @@
+# intent_extractor.py
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ACCOUNT_DATA_FILE = os.environ.get(
+    "ACCOUNT_DATA_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_data.json"))
+
+
+def trie_regex(keywords: Iterable[str]) -> str:
+    """
+    Build a regex matching any of the keywords, factored as a character trie so
+    that matching costs the same however many keywords share a prefix. Longer
+    keywords are preferred over their prefixes.
+    """
+    trie: dict = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        if "" in node:
+            return "(?:" + "|".join(alternatives) + ")?"
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    return build(trie)
+
+
+@dataclass
+class Entities:
+    service: str = ""
+    receiver: str = ""
+    subscription: str = ""
+    amount: float = 0.0
+    # every match in the prompt as {"entity", "value", "start", "end"}
+    spans: List[dict] = field(default_factory=list)
+
+
+class IntentExtractor:
+    """
+    Extracts the requested service, receiver (also used as the user for add and
+    remove), subscription service and dollar amount from a user prompt.
+
+    All keywords are compiled into one case-insensitive regex together with the
+    amount pattern, so the prompt is scanned once. Keywords match at the start
+    of a word and may end in a plural "s" or "es" ("credit reports"). When
+    several keywords of an entity are found, the one listed last wins, and the
+    first amount in the prompt wins.
+    """
+
+    AMOUNT_PATTERN = r"\$\s?(?P<amount_value>\d[\d,]*(?:\.\d+)?)"
+
+    def __init__(self, services: Iterable[str], receivers: Iterable[str],
+                 subscriptions: Iterable[str]) -> None:
+        # keyword -> (entity, position of the keyword in its list)
+        self.entities: Dict[str, Tuple[str, int]] = {}
+        for entity, keywords in (("service", services), ("receiver", receivers),
+                                 ("subscription", subscriptions)):
+            for index, keyword in enumerate(keywords):
+                self.entities.setdefault(keyword.lower(), (entity, index))
+        alternatives = [f"(?P<amount>{self.AMOUNT_PATTERN})"]
+        if self.entities:
+            alternatives.append(rf"\b(?P<keyword>{trie_regex(self.entities)})(?:s|es)?\b")
+        self.pattern = re.compile("|".join(alternatives), re.IGNORECASE)
+
+    @classmethod
+    def from_file(cls, path: str = ACCOUNT_DATA_FILE) -> "IntentExtractor":
+        with open(path) as data_file:
+            data = json.load(data_file)
+        return cls(data["services"], data["users"], data["subscription_services"])
+
+    def extract(self, prompt: str) -> Entities:
+        entities = Entities()
+        ranks: Dict[str, int] = {}
+        for match in self.pattern.finditer(prompt):
+            if match.group("amount"):
+                entity = "amount"
+                value: Optional[object] = float(match.group("amount_value").replace(",", ""))
+            else:
+                value = match.group("keyword").lower()
+                entity, rank = self.entities[value]
+            entities.spans.append({"entity": entity, "value": value,
+                                   "start": match.start(), "end": match.end()})
+            if entity == "amount":
+                if not entities.amount:
+                    entities.amount = value
+            elif rank >= ranks.get(entity, -1):
+                ranks[entity] = rank
+                setattr(entities, entity, value)
+        return entities
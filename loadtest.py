@@ -0,0 +1,204 @@
+# loadtest.py
+"""
+Load test of the backend business services.
+
+Sends a weighted mix of /accountservice and /processuserpmt requests from
+benchmarks/restservice_workload.jsonl at increasing concurrency and reports
+throughput, error rate and latency percentiles per concurrency level. By
+default the requests go to restservice.py's Flask app in-process; with --url
+they go to a running instance, e.g. one started with RESTSERVICE_MODE=production.
+
+    python3 loadtest.py
+    python3 loadtest.py --url http://127.0.0.1:5000 --concurrency 1 8 32 --duration 20
+    python3 loadtest.py --max-p95 0.05 --max-error-rate 0.01
+    python3 loadtest.py --url http://127.0.0.1:5000 --check-metrics
+
+Exits with status 1 when a level exceeds --max-p95 or --max-error-rate, so it
+can gate a deployment. --check-metrics also fails when the request counts of
+the instance's /metrics do not add up to the requests sent, e.g. when the
+gunicorn workers' metrics are not summed.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+import requests
+
+# (path, params) -> HTTP status code
+Sender = Callable[[str, dict], int]
+
+# time for every worker of the instance to publish its metrics
+METRICS_FLUSH_WAIT_SECONDS = 3.0
+
+
+def load_workload(path: str) -> List[dict]:
+    with open(path) as workload_file:
+        return [json.loads(line) for line in workload_file if line.strip()]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+def in_process_sender() -> Callable[[], Sender]:
+    """
+    Senders calling restservice.py's Flask app directly, one test client per thread.
+    """
+    import restservice
+
+    def make_sender() -> Sender:
+        client = restservice.app.test_client()
+        return lambda path, params: client.get(path, query_string=params).status_code
+
+    return make_sender
+
+
+def http_sender(url: str, timeout: float) -> Callable[[], Sender]:
+    """
+    Senders calling a running instance, one pooled session per thread.
+    """
+    def make_sender() -> Sender:
+        session = requests.Session()
+        return lambda path, params: session.get(url.rstrip("/") + path, params=params,
+                                                timeout=timeout).status_code
+
+    return make_sender
+
+
+def scrape_request_count(url: str, paths: List[str], timeout: float) -> int:
+    """
+    Requests to the given endpoints counted by the instance's /metrics.
+    """
+    text = requests.get(url.rstrip("/") + "/metrics", timeout=timeout).text
+    return sum(int(float(count)) for endpoint, count in
+               re.findall(r'^\w+_requests_total\{endpoint="([^"]*)"[^}]*\} (\S+)$', text, re.MULTILINE)
+               if endpoint in paths)
+
+
+def run_level(make_sender: Callable[[], Sender], workload: List[dict], concurrency: int,
+              duration: float, seed: int) -> dict:
+    """
+    Run concurrency closed-loop clients for duration seconds, each picking
+    requests from the workload by weight.
+    """
+    latencies: List[float] = []
+    errors = []
+    lock = threading.Lock()
+    weights = [item.get("weight", 1) for item in workload]
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def client(index: int) -> None:
+        rng = random.Random(seed + index)
+        send = make_sender()
+        local_latencies = []
+        local_errors = 0
+        start_barrier.wait()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            item = rng.choices(workload, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = send(item["path"], item.get("params", {})) < 400
+            except Exception:
+                # any failure, e.g. a 500 raised by the in-process sender, is an error not a dead client
+                ok = False
+            local_latencies.append(time.perf_counter() - started)
+            local_errors += not ok
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {"concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": sum(errors),
+            "error_rate": sum(errors) / len(latencies) if latencies else 0.0,
+            "throughput": len(latencies) / elapsed if elapsed else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+            }
+
+
+def print_level(level: dict) -> None:
+    def fmt(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+
+    print(f"  {level['concurrency']:>4} clients  {level['throughput']:>9.1f} req/s  "
+          f"errors {level['error_rate']:6.2%}  p50 {fmt(level['p50'])}  p95 {fmt(level['p95'])}  "
+          f"p99 {fmt(level['p99'])}  max {fmt(level['max'])}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the backend business services")
+    parser.add_argument("--workload", default="benchmarks/restservice_workload.jsonl")
+    parser.add_argument("--url", help="base URL of a running instance (default: restservice.py in-process)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="numbers of concurrent clients to run, in order")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--timeout", type=float, default=10.0, help="HTTP timeout in seconds with --url")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the request mix")
+    parser.add_argument("--max-p95", type=float, help="fail when a level's p95 latency exceeds this many seconds")
+    parser.add_argument("--max-error-rate", type=float, help="fail when a level's error rate exceeds this fraction")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--check-metrics", action="store_true",
+                        help="with --url, fail when /metrics does not count every request sent")
+    args = parser.parse_args()
+    if args.check_metrics and not args.url:
+        parser.error("--check-metrics needs --url")
+
+    workload = load_workload(args.workload)
+    make_sender = http_sender(args.url, args.timeout) if args.url else in_process_sender()
+    paths = sorted({item["path"] for item in workload})
+    counted_before = scrape_request_count(args.url, paths, args.timeout) if args.check_metrics else 0
+
+    print(f"{args.url or 'restservice.py (in-process)'}, {args.duration:.0f}s per level")
+    levels = []
+    failed = False
+    for concurrency in args.concurrency:
+        level = run_level(make_sender, workload, concurrency, args.duration, args.seed)
+        print_level(level)
+        levels.append(level)
+        if args.max_p95 is not None and (level["p95"] or 0.0) > args.max_p95:
+            print(f"  p95 above {args.max_p95 * 1000:.1f}ms", file=sys.stderr)
+            failed = True
+        if args.max_error_rate is not None and level["error_rate"] > args.max_error_rate:
+            print(f"  error rate above {args.max_error_rate:.2%}", file=sys.stderr)
+            failed = True
+
+    if args.check_metrics:
+        # workers write their counts to the shared metrics directory about once a second
+        time.sleep(METRICS_FLUSH_WAIT_SECONDS)
+        counted = scrape_request_count(args.url, paths, args.timeout) - counted_before
+        sent = sum(level["requests"] for level in levels)
+        print(f"/metrics counted {counted} of {sent} requests")
+        if counted != sent:
+            print("  /metrics does not add up to the requests sent", file=sys.stderr)
+            failed = True
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"target": args.url or "in-process", "levels": levels}, output_file, indent=4)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# model_registry.py
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.callbacks.manager import CallbackManager
+from langchain.llms import LlamaCpp
+
+
+def current_rss_bytes() -> int:
+    """
+    Resident set size of the current process in bytes, 0 when it cannot be read.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+@dataclass
+class LoadedModel:
+    llm: LlamaCpp
+    model_path: str
+    params: Dict[str, Any]
+    load_seconds: float
+    file_bytes: int
+    rss_delta_bytes: int
+    loaded_at: float
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded LlamaCpp models.
+
+    Streamlit re-executes the app script on every interaction and runs every
+    browser session in its own thread, but imported modules stay resident, so
+    models kept here are loaded once and shared by all sessions.
+    """
+
+    def __init__(self) -> None:
+        self._models: Dict[Tuple, LoadedModel] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model_path: str, params: Dict[str, Any]) -> Tuple:
+        return (os.path.abspath(model_path), tuple(sorted(params.items())))
+
+    def get(self, model_path: str,
+            callback_manager: Optional[CallbackManager] = None,
+            **params: Any) -> LlamaCpp:
+        """
+        Return the model for this path and generation params, loading it on
+        first use. The callback manager is only attached when the model is
+        loaded and is not part of the registry key.
+        """
+        key = self._key(model_path, params)
+        entry = self._models.get(key)
+        if entry is not None:
+            return entry.llm
+        # Loading takes seconds to minutes, hold the lock so concurrent
+        # sessions wait for the same load instead of each reading the GGUF.
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                entry = self._load(model_path, callback_manager, params)
+                self._models[key] = entry
+        return entry.llm
+
+    def _load(self, model_path: str,
+              callback_manager: Optional[CallbackManager],
+              params: Dict[str, Any]) -> LoadedModel:
+        rss_before = current_rss_bytes()
+        started = time.perf_counter()
+        llm = LlamaCpp(model_path=model_path,
+                       callback_manager=callback_manager, **params)
+        load_seconds = time.perf_counter() - started
+        try:
+            file_bytes = os.path.getsize(model_path)
+        except OSError:
+            file_bytes = 0
+        return LoadedModel(
+            llm=llm,
+            model_path=model_path,
+            params=dict(params),
+            load_seconds=load_seconds,
+            file_bytes=file_bytes,
+            rss_delta_bytes=max(current_rss_bytes() - rss_before, 0),
+            loaded_at=time.time(),
+        )
+
+    def unload(self, model_path: str, **params: Any) -> bool:
+        """
+        Drop a model from the registry. Returns False if it was not loaded.
+        """
+        with self._lock:
+            return self._models.pop(self._key(model_path, params), None) is not None
+
+    def stats(self) -> List[dict]:
+        """
+        Load time and memory footprint of every resident model.
+        """
+        return [{"model_path": entry.model_path,
+                 "params": entry.params,
+                 "load_seconds": entry.load_seconds,
+                 "file_mb": entry.file_bytes / 2**20,
+                 "rss_delta_mb": entry.rss_delta_bytes / 2**20,
+                 "loaded_at": entry.loaded_at,
+                 } for entry in list(self._models.values())]
+
+
+registry = ModelRegistry()
@@ -0,0 +1,169 @@
+# response_cache.py
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence
+
+# GGUF embedding model used to match similar questions, the similarity match is off when empty
+ANSWER_CACHE_EMBEDDING_MODEL = os.environ.get("ANSWER_CACHE_EMBEDDING_MODEL", "")
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+# Most recent messages of the history sent to the model that are part of the key
+ANSWER_CACHE_HISTORY_MESSAGES = int(os.environ.get("ANSWER_CACHE_HISTORY_MESSAGES", "2"))
+
+
+def normalize_context(text: str) -> str:
+    """
+    Collapse whitespace only, account data such as payee names is case-sensitive.
+    """
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Case fold, collapse whitespace and drop trailing punctuation so that
+    "Transfer $100 to Ram?" and "transfer $100 to ram" share a cache entry.
+    """
+    return normalize_context(text).rstrip("?!. ").lower()
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    context_key: str
+    embedding: Optional[List[float]]
+    created_at: float
+
+
+class ResponseCache:
+    """
+    Answer cache for RAG questions asked with a deterministic (temperature 0) model.
+
+    Entries are keyed by model, normalized account services context, the last
+    history_messages messages of the history sent to the model, and normalized
+    question. When an embed function is given, a question that misses the
+    exact key is also matched by cosine similarity against the cached
+    questions with the same context and history. Entries expire after
+    ttl_seconds and the least recently used ones are evicted above max_entries.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600.0,
+                 embed: Optional[Callable[[str], List[float]]] = None,
+                 similarity_threshold: float = 0.95,
+                 history_messages: int = 2) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # a missed question is embedded by get() and again by put()
+        self.embed = lru_cache(maxsize=256)(embed) if embed is not None else None
+        self.similarity_threshold = similarity_threshold
+        self.history_messages = history_messages
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _context_key(self, model: str, context: str, history: Sequence[dict]) -> str:
+        # history holds the {"role", "content"} messages the context window sends
+        # before the question. Only the latest are keyed, so the answers to
+        # common questions are shared between conversations
+        recent = list(history)[-self.history_messages:] if self.history_messages else []
+        history_json = json.dumps([[m["role"], m["content"]] for m in recent], ensure_ascii=False)
+        return hashlib.sha256(
+            f"{model}\0{normalize_context(context)}\0{history_json}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, question: str, context: str,
+            history: Sequence[dict] = ()) -> Optional[str]:
+        context_key = self._context_key(model, context, history)
+        question = normalize_prompt(question)
+        key = f"{context_key}:{question}"
+        cutoff = time.time() - self.ttl_seconds
+        candidates = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.created_at < cutoff:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.answer
+            if self.embed is not None:
+                candidates = [(entry_key, entry) for entry_key, entry in self._entries.items()
+                              if entry.context_key == context_key and entry.embedding is not None
+                              and entry.created_at >= cutoff]
+        if candidates:
+            embedding = self.embed(question)
+            best_key, best = max(candidates, key=lambda item: _cosine(embedding, item[1].embedding))
+            if _cosine(embedding, best.embedding) >= self.similarity_threshold:
+                with self._lock:
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                    self.similar_hits += 1
+                return best.answer
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model: str, question: str, context: str, answer: str,
+            history: Sequence[dict] = ()) -> None:
+        context_key = self._context_key(model, context, history)
+        question = normalize_prompt(question)
+        embedding = self.embed(question) if self.embed is not None else None
+        with self._lock:
+            key = f"{context_key}:{question}"
+            self._entries[key] = CachedAnswer(answer=answer, context_key=context_key,
+                                              embedding=embedding, created_at=time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.similar_hits + self.misses
+        return {"entries": len(self._entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0,
+                }
+
+
+def llama_cpp_embed(model_path: str) -> Callable[[str], List[float]]:
+    """
+    Embedding function of a GGUF embedding model, which is loaded on first use.
+    """
+    embeddings = []
+    # llama.cpp contexts are not thread safe, sessions embed one at a time
+    lock = threading.Lock()
+
+    def embed(text: str) -> List[float]:
+        with lock:
+            if not embeddings:
+                from langchain.embeddings import LlamaCppEmbeddings
+                embeddings.append(LlamaCppEmbeddings(model_path=model_path, verbose=False))
+            return embeddings[0].embed_query(text)
+
+    return embed
+
+
+# Shared by all sessions so answers survive Streamlit reruns
+answer_cache = ResponseCache(
+    embed=llama_cpp_embed(ANSWER_CACHE_EMBEDDING_MODEL) if ANSWER_CACHE_EMBEDDING_MODEL else None,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    history_messages=ANSWER_CACHE_HISTORY_MESSAGES)
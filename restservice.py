@@ -1,13 +1,44 @@
 # using flask_restful 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_restful import Resource, Api, reqparse
-#import nltk 
+import nltk 
+from nltk.tag import PerceptronTagger
+import os
+import shutil
 import requests
 
+from intent_extractor import IntentExtractor
+from account_store import create_store
+from service_metrics import CONTENT_TYPE, ServiceMetrics
+
+# 'dev' runs the Flask development server, 'production' runs gunicorn with gunicorn.conf.py (waitress on Windows)
+RESTSERVICE_MODE = os.environ.get('RESTSERVICE_MODE', 'dev')
+RESTSERVICE_HOST = os.environ.get('RESTSERVICE_HOST', '127.0.0.1')
+RESTSERVICE_PORT = int(os.environ.get('RESTSERVICE_PORT', '5000'))
+RESTSERVICE_THREADS = int(os.environ.get('RESTSERVICE_THREADS', '4'))
+
+# 'local' resolves /processuserpmt requests in-process, 'remote' calls the /accountservice endpoint at ACCOUNT_SERVICE_URL
+ACCOUNT_SERVICE_MODE = os.environ.get('ACCOUNT_SERVICE_MODE', 'local')
+ACCOUNT_SERVICE_URL = os.environ.get('ACCOUNT_SERVICE_URL', 'http://127.0.0.1:5000')
+
+# largest number of prompts accepted by /processuserpmt/batch
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '1000'))
+
+# with METRICS_DIR set, the worker processes share their counts there and /metrics reports the totals
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
+# keywords for the services, users and subscription services, see account_data.json
+intent_extractor = IntentExtractor.from_file()
+# users, payees and subscription products, indexed by case-folded name (ACCOUNT_STORE=memory|sqlite)
+account_store = create_store()
+
 # creating the flask app 
 app = Flask(__name__) 
 # creating an API object 
 api = Api(app) 
+# per-endpoint latency, in-flight requests, errors and stage timings, served at /metrics
+metrics = ServiceMetrics(directory=METRICS_DIR or None)
+metrics.init_app(app)
 
 # making a class for a particular resource 
 # the get, post methods correspond to get and post requests 
@@ -29,72 +60,95 @@ class Hello(Resource):
 		return jsonify({'data': data}), 201
 
 
-class AccountService(Resource):
+class Health(Resource):
 
+	# liveness, the process is up and serving requests
 	def get(self):
-		service_type = str(request.args.get('servicetype'))
-		sender_name =  str(request.args.get('sender'))
-		receiver_name = str(request.args.get('receiver'))
-		service_name = str(request.args.get('service'))
-		amount_str = str(request.args.get('amount'))
-		user_name = str(request.args.get('user'))
-		amount=0.0
-		found_match=False
-		user_names = ['joseph', 'john', 'carole', 'peter', 'ram']
-		subscription_services = ['credit report', 'mutual funds', 'financial consulting', 'retirement services']
+		return jsonify(status='ok')
+
+
+class Ready(Resource):
+
+	# readiness, the account data is loaded and can be queried
+	def get(self):
+		try:
+			account_store.is_user('')
+		except Exception as e:
+			return {'status': 'unavailable', 'error': str(e)}, 503
+		return jsonify(status='ready', nlp=pos_tagger is not None)
+
+
+class Metrics(Resource):
+
+	# Prometheus text exposition format, counters are per worker process
+	def get(self):
+		return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+def resolve_account_service(service_type, sender_name, receiver_name, service_name, amount_str, user_name, store=None):
+	"""
+	Account service logic shared by the /accountservice and /processuserpmt endpoints.
+	Arguments are the query string values of /accountservice, "None" when not given.
+	store defaults to the service's account store.
+	"""
+	if store is None:
+		store = account_store
+	amount=0.0
         
-		if(amount_str != "None"):
-			amount=float(amount_str)
+	if(amount_str != "None"):
+		amount=float(amount_str)
         # process the services type
-		if(service_type.upper() == "TRANSFER"):
-			if(amount == 0.0):
-				result='Please enter a valid amount to transfer'
-			elif(receiver_name.upper() == "JOSEPH"):
-				result='Joseph is not registred as a reciever in your account, I have created a registration form for you , pleae authorize the registration using this form ([Registration form](http://xbcbank.com?ajb87u)) \n'
-			elif(receiver_name.upper()== "PETER"):
-				result='Insufficient funds to complete the transfer \n'
-			elif(receiver_name.upper()=="RAM"):
-				result=f"Amount ${amount} transferred successfully to {receiver_name}, I see that you make this transaction every month, you want me to add this as a recurring payment? \n"
-			else:
-				result= f'Amount ${amount} transferred successfully to {receiver_name}! \n'
-
-		elif(service_type.upper() == "SUBSCRIBE"):
-			for service in subscription_services:
-				if(service.upper()==service_name.upper()):
-					found_match=True
+	if(service_type.upper() == "TRANSFER"):
+		payee_status = store.payee_status(receiver_name)
+		if(amount == 0.0):
+			result='Please enter a valid amount to transfer'
+		elif(payee_status == "unregistered"):
+			result=f'{receiver_name.capitalize()} is not registred as a reciever in your account, I have created a registration form for you , pleae authorize the registration using this form ([Registration form](http://xbcbank.com?ajb87u)) \n'
+		elif(payee_status == "insufficient_funds"):
+			result='Insufficient funds to complete the transfer \n'
+		elif(payee_status == "recurring"):
+			result=f"Amount ${amount} transferred successfully to {receiver_name}, I see that you make this transaction every month, you want me to add this as a recurring payment? \n"
+		else:
+			result= f'Amount ${amount} transferred successfully to {receiver_name}! \n'
 
-			if (found_match):
-				result="Subsription completed successfully! \n"
-			else:
-				result=f"I am afraid we do not offer {service_name} as a service, can you please verify if you are requesting a valid banking services? \n"
+	elif(service_type.upper() == "SUBSCRIBE"):
+		if (store.is_subscription(service_name)):
+			result="Subsription completed successfully! \n"
+		else:
+			result=f"I am afraid we do not offer {service_name} as a service, can you please verify if you are requesting a valid banking services? \n"
 
-		elif(service_type.upper() == "ADD"):
+	elif(service_type.upper() == "ADD"):
 
-			for user in user_names :
-				if(user.upper() == user_name.upper()):	
-					found_match=True
-			if(found_match):
-				result=f"I see that {user_name} is a valid user and can be added to your account. Can you authorize the completed registration form ([Authorization form](http://xbcbank.com?uiue)) for me to complete the request? \n"
-			else:
-				result=f"The user {user_name} is not eligible for this service, Can you please check and reach out to bank for further assistance! \n"
+		if(store.is_user(user_name)):
+			result=f"I see that {user_name} is a valid user and can be added to your account. Can you authorize the completed registration form ([Authorization form](http://xbcbank.com?uiue)) for me to complete the request? \n"
+		else:
+			result=f"The user {user_name} is not eligible for this service, Can you please check and reach out to bank for further assistance! \n"
 
-		elif(service_type.upper() == "REMOVE"):
-			found_match=False
+	elif(service_type.upper() == "REMOVE"):
 
-			for user in user_names :
-				if(user.upper() == user_name.upper()):
-					found_match=True
-			if(found_match):
-				result=f"The user {user_name} removed successfully from your account! \n"
-			else:
-				result= f'The user {user_name} is not registered for this service, Can you please check and reach out to bank for further assistance! \n'			
-			
-		
+		if(store.is_user(user_name)):
+			result=f"The user {user_name} removed successfully from your account! \n"
 		else:
-			result="Invalid request, can you please explain what you are looking for? \n"
+			result= f'The user {user_name} is not registered for this service, Can you please check and reach out to bank for further assistance! \n'			
+		
+	
+	else:
+		result="Invalid request, can you please explain what you are looking for? \n"
+
+	return result
 
 
-			
+class AccountService(Resource):
+
+	def get(self):
+		service_type = str(request.args.get('servicetype'))
+		sender_name =  str(request.args.get('sender'))
+		receiver_name = str(request.args.get('receiver'))
+		service_name = str(request.args.get('service'))
+		amount_str = str(request.args.get('amount'))
+		user_name = str(request.args.get('user'))
+		with metrics.stage('account_lookup'):
+			result = resolve_account_service(service_type, sender_name, receiver_name, service_name, amount_str, user_name)
 
 		return jsonify(
         	#servicetype=service_type,
@@ -108,67 +162,70 @@ class AccountService(Resource):
 is_noun = lambda pos: pos[:2] == 'NN'
 is_verb = lambda pos: pos[:2] == 'VB'
 
+def init_nlp():
+    """
+    Load the NLTK tokenizer and tagger once at startup. Data is only read from
+    the local NLTK data paths (NLTK_DATA), nothing is downloaded.
+    Returns None when the data is not installed.
+    """
+    try:
+        nltk.word_tokenize('warm up')
+        return PerceptronTagger()
+    except LookupError as e:
+        app.logger.warning(f'NLP endpoint disabled, NLTK data not found: {e}')
+        return None
+
+pos_tagger = init_nlp()
+
+def tag_prompts(user_prompts):
+    """
+    Tokenize and tag each prompt exactly once.
+    """
+    tagged_prompts = pos_tagger.tag_sents([nltk.word_tokenize(user_prompt) for user_prompt in user_prompts])
+    return [dict(
+            outcome='success',
+            input=user_prompt,
+            nouns=[word for (word, pos) in tagged if is_noun(pos)],
+            verbs=[word for (word, pos) in tagged if is_verb(pos)],
+            result=tagged
+        ) for user_prompt, tagged in zip(user_prompts, tagged_prompts)]
+
 class ProcessUserPromptWithNLP(Resource):
 
     def get(self):
+        if pos_tagger is None:
+            return {'outcome': 'error', 'error': 'NLTK tokenizer and tagger data are not installed'}, 503
         user_prompt = str(request.args.get('prompt'))
-        text = nltk.word_tokenize(user_prompt)
-        nouns = [word for (word, pos) in nltk.pos_tag(text) if is_noun(pos)]
-        verbs = [word for (word, pos) in nltk.pos_tag(text) if is_verb(pos)]
-        
+        return jsonify(**tag_prompts([user_prompt])[0])
 
-        result = nltk.pos_tag(text)
-		
-        return jsonify(
-            outcome='success',
-            input=user_prompt,
-			nouns=nouns,
-			verbs=verbs,
-			result=result
-        )
+    # batched form, {"prompts": [...]} tags all prompts in one call
+    def post(self):
+        if pos_tagger is None:
+            return {'outcome': 'error', 'error': 'NLTK tokenizer and tagger data are not installed'}, 503
+        user_prompts = (request.get_json(silent=True) or {}).get('prompts')
+        if not isinstance(user_prompts, list):
+            return {'outcome': 'error', 'error': 'prompts must be a list of strings'}, 400
+        return jsonify(results=tag_prompts([str(user_prompt) for user_prompt in user_prompts]))
+
+def remote_account_service(entities, session=requests):
+	accountservices_url=f'{ACCOUNT_SERVICE_URL}/accountservice?servicetype={entities.service}&sender=xu&receiver={entities.receiver}&service={entities.subscription}&user={entities.receiver}&amount={entities.amount}'
+	return session.get(accountservices_url).json()['result']
 
 class ProcessUserPrompt(Resource):
 
 	def get(self):
-		#static variables
-		amount=0.0
-		service = ''
-		receiver = ''
-		user=''
-		subscriptionservice=''
-		subscription_services = ['credit report', 'mutual funds', 'financial consulting', 'retirement services']
-		services = ['subscribe', 'transfer', 'add', 'remove']
-		receiver_names = ['joseph', 'john', 'carole', 'peter', 'ram'] # used for both receiver name and user depednding on the service
-
-        
-		user_prompt = str(request.args.get('prompt').lower())
-		index = -1
-
-		for service_type in services:
-			index = user_prompt.find(service_type)
-			if (index > 0):
-				service = service_type
-
-        #used for receiver and user for this demo
-		for receiver_name in receiver_names:
-			index = user_prompt.find(receiver_name)
-			if (index > 0):
-				receiver = receiver_name
-		
-		for subscriptionservice_type in subscription_services:
-			index = user_prompt.find(subscriptionservice_type)
-			if (index > 0):
-				subscriptionservice=subscriptionservice_type
-
-			
-		words = user_prompt.split()
-		for word in words:
-			if word.startswith('$'):
-				amount=float(word.strip('$'))
-          
-		accountservices_url=f'http://127.0.0.1:5000/accountservice?servicetype={service}&sender=xu&receiver={receiver}&service={subscriptionservice}&user={receiver}&amount={amount}'
-		result = requests.get(accountservices_url).json()
-		return result
+		user_prompt = str(request.args.get('prompt'))
+		# single pass over the prompt for service, receiver (also used as user for this demo), subscription and amount
+		with metrics.stage('entity_extraction'):
+			entities = intent_extractor.extract(user_prompt)
+
+		with metrics.stage('account_lookup'):
+			if(ACCOUNT_SERVICE_MODE == 'remote'):
+				result = remote_account_service(entities)
+			else:
+				# resolved in-process, no HTTP round-trip back into this service
+				result = resolve_account_service(entities.service, 'xu', entities.receiver, entities.subscription, str(entities.amount), entities.receiver)
+		return jsonify(result=result)
 		
 
 		#return jsonify(
@@ -181,14 +238,70 @@ class ProcessUserPrompt(Resource):
 		#	url=accountservices_url
 		#)
 
+class ProcessUserPromptBatch(Resource):
+
+	# {"prompts": [...]} -> {"results": [{"prompt": ..., "result": ...}, ...]} in the same order
+	def post(self):
+		user_prompts = (request.get_json(silent=True) or {}).get('prompts')
+		if not isinstance(user_prompts, list):
+			return {'error': 'prompts must be a list of strings'}, 400
+		if len(user_prompts) > MAX_BATCH_SIZE:
+			return {'error': f'at most {MAX_BATCH_SIZE} prompts per batch'}, 413
+
+		user_prompts = [str(user_prompt) for user_prompt in user_prompts]
+		with metrics.stage('batch_entity_extraction'):
+			batch_entities = [intent_extractor.extract(user_prompt) for user_prompt in user_prompts]
+		# prompts with the same intent share one resolution
+		intents = {(entities.service, entities.receiver, entities.subscription, entities.amount): entities
+				   for entities in batch_entities}
+
+		with metrics.stage('batch_account_lookup'):
+			if(ACCOUNT_SERVICE_MODE == 'remote'):
+				with requests.Session() as session:
+					resolved = {intent: remote_account_service(entities, session) for intent, entities in intents.items()}
+			else:
+				# one bulk lookup per kind of account data for the whole batch
+				receivers = [receiver for (_, receiver, _, _) in intents]
+				store = account_store.snapshot(users=receivers, payees=receivers,
+											   subscriptions=[subscription for (_, _, subscription, _) in intents])
+				resolved = {(service, receiver, subscription, amount):
+								resolve_account_service(service, 'xu', receiver, subscription, str(amount), receiver, store)
+							for (service, receiver, subscription, amount) in intents}
+
+		return jsonify(results=[
+			{'prompt': user_prompt,
+			 'result': resolved[(entities.service, entities.receiver, entities.subscription, entities.amount)]}
+			for user_prompt, entities in zip(user_prompts, batch_entities)])
+
 # adding the defined resources along with their corresponding urls 
 api.add_resource(Hello, '/') 
 api.add_resource(AccountService,'/accountservice')
 api.add_resource(ProcessUserPromptWithNLP,'/processpmtnlp')
 api.add_resource(ProcessUserPrompt,'/processuserpmt')
+api.add_resource(ProcessUserPromptBatch,'/processuserpmt/batch')
+
+api.add_resource(Health,'/health')
+api.add_resource(Ready,'/ready')
+api.add_resource(Metrics,'/metrics')
+
+def run_production():
+	"""
+	Serve the app with gunicorn using gunicorn.conf.py, or with waitress where
+	gunicorn is not available (Windows).
+	"""
+	gunicorn = shutil.which('gunicorn')
+	if gunicorn:
+		config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+		os.chdir(os.path.dirname(os.path.abspath(__file__)))
+		os.execv(gunicorn, [gunicorn, '-c', config, 'restservice:app'])
+	from waitress import serve
+	serve(app, host=RESTSERVICE_HOST, port=RESTSERVICE_PORT, threads=RESTSERVICE_THREADS)
 
 # driver function 
 if __name__ == '__main__': 
 
-	app.run(debug = True) 
+	if(RESTSERVICE_MODE == 'production'):
+		run_production()
+	else:
+		app.run(host=RESTSERVICE_HOST, port=RESTSERVICE_PORT, debug = True) 
 
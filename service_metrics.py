@@ -0,0 +1,272 @@
+# service_metrics.py
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, g, request
+
+# Histogram buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Counts of the workers that exited, kept in the metrics directory next to the worker files
+ARCHIVE_FILE = "archive.json"
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class Histogram:
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        return {"counts": list(self.counts), "count": self.count, "sum": self.sum}
+
+    def merge(self, other: dict) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other["counts"])]
+        self.count += other["count"]
+        self.sum += other["sum"]
+
+    def render(self, name: str, labels: str) -> List[str]:
+        separator = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class ServiceMetrics:
+    """
+    Request latency histograms, in-flight requests, request and error counts per
+    endpoint, and time spent in named processing stages, rendered in the
+    Prometheus text format.
+
+    Metrics are counted per process. When directory is set, every process
+    writes its counts to worker-<pid>.json in directory every flush_interval
+    seconds, and render() sums them, so any gunicorn worker answering /metrics
+    reports the totals of the service. The counts of exited workers are moved
+    to archive.json by archive_worker() so counters never go down.
+    """
+
+    def __init__(self, prefix: str = "restservice", directory: Optional[str] = None,
+                 flush_interval: float = 1.0) -> None:
+        self.prefix = prefix
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        self.in_flight = 0
+        self.latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.stages: Dict[str, Histogram] = defaultdict(Histogram)
+        self.requests: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a processing stage, e.g. entity extraction or account lookup.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.stages[name].observe(elapsed)
+
+    def _start_flusher(self) -> None:
+        # threads do not survive the fork of a preloaded app, so every worker
+        # starts its own on its first request
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_forever, name="metrics-flusher", daemon=True).start()
+
+    def _flush_forever(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the counts of this process to its file in directory.
+        """
+        if self.directory:
+            write_json(os.path.join(self.directory, f"worker-{os.getpid()}.json"), self.snapshot())
+
+    def _before_request(self) -> None:
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        g.metrics_started = time.perf_counter()
+        g.metrics_status = "500"
+        with self._lock:
+            self.in_flight += 1
+
+    def _after_request(self, response):
+        g.metrics_status = str(response.status_code)
+        return response
+
+    def _teardown_request(self, exception) -> None:
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        status = "500" if exception is not None else g.pop("metrics_status", "500")
+        with self._lock:
+            self.in_flight -= 1
+            self.latency[endpoint].observe(elapsed)
+            self.requests[(endpoint, request.method, status)] += 1
+            if status.startswith("5"):
+                self.errors[endpoint] += 1
+
+    def snapshot(self) -> dict:
+        """
+        The counts of this process in the JSON form written to the metrics directory.
+        """
+        with self._lock:
+            return to_snapshot({"in_flight": self.in_flight, "latency": self.latency, "stages": self.stages,
+                                "requests": self.requests, "errors": self.errors})
+
+    def _snapshots(self) -> List[dict]:
+        """
+        This process's counts and those of the other workers and exited workers in directory.
+        """
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        own_file = f"worker-{os.getpid()}.json"
+        for file_name in os.listdir(self.directory):
+            if file_name != own_file and (file_name == ARCHIVE_FILE or
+                                          (file_name.startswith("worker-") and file_name.endswith(".json"))):
+                snapshot = read_json(os.path.join(self.directory, file_name))
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return snapshots
+
+    def render(self) -> str:
+        total = merge_snapshots(self._snapshots())
+        name = self.prefix
+        lines = [f"# HELP {name}_requests_in_flight Requests currently being served.",
+                 f"# TYPE {name}_requests_in_flight gauge",
+                 f"{name}_requests_in_flight {total['in_flight']}",
+                 f"# HELP {name}_requests_total Requests served by endpoint, method and status.",
+                 f"# TYPE {name}_requests_total counter"]
+        for (endpoint, method, status), count in sorted(total["requests"].items()):
+            lines.append(f"{name}_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {count}")
+        lines += [f"# HELP {name}_request_errors_total Requests that failed with a 5xx status.",
+                  f"# TYPE {name}_request_errors_total counter"]
+        for endpoint, count in sorted(total["errors"].items()):
+            lines.append(f"{name}_request_errors_total{{{_labels(endpoint=endpoint)}}} {count}")
+        lines += [f"# HELP {name}_request_duration_seconds Request latency by endpoint.",
+                  f"# TYPE {name}_request_duration_seconds histogram"]
+        for endpoint, histogram in sorted(total["latency"].items()):
+            lines += histogram.render(f"{name}_request_duration_seconds", _labels(endpoint=endpoint))
+        lines += [f"# HELP {name}_stage_duration_seconds Time spent in processing stages.",
+                  f"# TYPE {name}_stage_duration_seconds histogram"]
+        for stage, histogram in sorted(total["stages"].items()):
+            lines += histogram.render(f"{name}_stage_duration_seconds", _labels(stage=stage))
+        return "\n".join(lines) + "\n"
+
+
+def to_snapshot(metrics: dict) -> dict:
+    """
+    The JSON form of histograms and counts keyed like ServiceMetrics' own.
+    """
+    return {"in_flight": metrics["in_flight"],
+            "latency": {name: histogram.to_dict() for name, histogram in metrics["latency"].items()},
+            "stages": {name: histogram.to_dict() for name, histogram in metrics["stages"].items()},
+            "requests": [[endpoint, method, status, count]
+                         for (endpoint, method, status), count in metrics["requests"].items()],
+            "errors": dict(metrics["errors"])}
+
+
+def merge_snapshots(snapshots: List[dict]) -> dict:
+    """
+    Sum snapshots into histograms and counts keyed like ServiceMetrics' own.
+    """
+    total: dict = {"in_flight": 0, "latency": defaultdict(Histogram), "stages": defaultdict(Histogram),
+                   "requests": defaultdict(int), "errors": defaultdict(int)}
+    for snapshot in snapshots:
+        total["in_flight"] += snapshot["in_flight"]
+        for kind in ("latency", "stages"):
+            for name, histogram in snapshot[kind].items():
+                total[kind][name].merge(histogram)
+        for endpoint, method, status, count in snapshot["requests"]:
+            total["requests"][(endpoint, method, status)] += count
+        for endpoint, count in snapshot["errors"].items():
+            total["errors"][endpoint] += count
+    return total
+
+
+def read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: str, data: dict) -> None:
+    # written under a temporary name so readers never see a partial file
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(temporary_path, path)
+
+
+def clear_metrics_dir(directory: str) -> None:
+    """
+    Create directory, or remove the metrics files of an earlier run from it.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for file_name in os.listdir(directory):
+        if file_name.startswith(("worker-", ARCHIVE_FILE)):
+            os.remove(os.path.join(directory, file_name))
+
+
+def archive_worker(directory: str, pid: int) -> None:
+    """
+    Add the counts of an exited worker to the archive and remove its file.
+    Only called by the gunicorn master, one worker at a time.
+    """
+    worker_path = os.path.join(directory, f"worker-{pid}.json")
+    snapshot = read_json(worker_path)
+    if snapshot is None:
+        return
+    # the requests in flight of an exited worker are over
+    snapshot["in_flight"] = 0
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    archived = read_json(archive_path)
+    write_json(archive_path, to_snapshot(merge_snapshots([snapshot] + ([archived] if archived else []))))
+    os.remove(worker_path)
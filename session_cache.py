@@ -0,0 +1,97 @@
+# session_cache.py
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from langchain.llms import LlamaCpp
+
+
+@dataclass
+class SessionState:
+    state: Any  # llama_cpp.LlamaState
+    last_used: float
+
+
+class SessionStateCache:
+    """
+    Keeps the evaluated llama.cpp state (KV cache and input tokens) of each
+    conversation between turns.
+
+    Before a turn the session's saved state is restored into the model, so
+    llama.cpp matches the already evaluated prefix of the new prompt and only
+    evaluates the tokens after it (the last answer and the new [INST] segment).
+    States are large (the full KV cache), so only the most recently used
+    sessions are kept and sessions idle for longer than idle_seconds are
+    dropped.
+    """
+
+    def __init__(self, max_sessions: int = 4, idle_seconds: float = 900.0) -> None:
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._states: "OrderedDict[str, SessionState]" = OrderedDict()
+        # llama.cpp contexts are not thread safe and restoring a state only
+        # makes sense if no other session generates in between.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generate(self, llm: LlamaCpp, session_id: str, prompt: str, **kwargs: Any) -> str:
+        """
+        Run the prompt on the model, reusing the evaluated prefix of this session.
+        """
+        with self._lock:
+            self._evict_idle()
+            entry = self._states.get(session_id)
+            if entry is not None:
+                llm.client.load_state(entry.state)
+                self.hits += 1
+            else:
+                self.misses += 1
+            answer = llm(prompt, **kwargs)
+            self._store(session_id, llm.client.save_state())
+        return answer
+
+    def drop(self, session_id: str) -> None:
+        """
+        Forget the saved state of a session, e.g. when its conversation is cleared.
+        """
+        with self._lock:
+            self._states.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._states),
+                "state_mb": sum(entry.state.llama_state_size
+                                for entry in self._states.values()) / 2**20,
+                "hits": self.hits,
+                "misses": self.misses,
+                }
+
+    def _store(self, session_id: str, state: Any) -> None:
+        self._states[session_id] = SessionState(state=state, last_used=time.time())
+        self._states.move_to_end(session_id)
+        while len(self._states) > self.max_sessions:
+            self._states.popitem(last=False)
+
+    def _evict_idle(self) -> None:
+        cutoff = time.time() - self.idle_seconds
+        for session_id in [session_id for session_id, entry in self._states.items()
+                           if entry.last_used < cutoff]:
+            del self._states[session_id]
+
+
+# One cache per resident model, kept at module level so it survives Streamlit reruns
+_caches: Dict[int, SessionStateCache] = {}
+_caches_lock = threading.Lock()
+
+
+def for_model(llm: LlamaCpp, **options: Any) -> SessionStateCache:
+    """
+    Return the session state cache of a model, creating it on first use.
+    """
+    with _caches_lock:
+        cache: Optional[SessionStateCache] = _caches.get(id(llm.client))
+        if cache is None:
+            cache = _caches[id(llm.client)] = SessionStateCache(**options)
+        return cache
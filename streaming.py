@@ -0,0 +1,56 @@
+# streaming.py
+import time
+from typing import Any, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+CURSOR = "▌"
+
+
+class StreamlitTokenHandler(BaseCallbackHandler):
+    """
+    Streams generated tokens into a Streamlit placeholder and records
+    time-to-first-token and tokens/sec of the answer.
+
+    Times are measured from the creation of the handler, i.e. from when the
+    user submitted the question, so they include any wait for the model.
+    """
+
+    def __init__(self, placeholder: Any = None) -> None:
+        self.placeholder = placeholder
+        self.text = ""
+        self.token_count = 0
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.token_count += 1
+        self.text += token
+        if self.placeholder is not None:
+            self.placeholder.markdown(self.text + CURSOR)
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        self.finished_at = time.perf_counter()
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        self.finished_at = time.perf_counter()
+
+    def metrics(self) -> dict:
+        """
+        Time-to-first-token, generation speed and total time of the answer in seconds.
+        """
+        finished_at = self.finished_at or time.perf_counter()
+        ttft = (self.first_token_at - self.started_at) if self.first_token_at else None
+        generation_seconds = (finished_at - self.first_token_at) if self.first_token_at else 0.0
+        # the first token closes the time-to-first-token window, the rest define the rate
+        tokens_per_sec = ((self.token_count - 1) / generation_seconds
+                          if generation_seconds > 0 and self.token_count > 1 else None)
+        return {"time_to_first_token": ttft,
+                "tokens_per_sec": tokens_per_sec,
+                "tokens": self.token_count,
+                "total_seconds": finished_at - self.started_at,
+                }